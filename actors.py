@@ -1,12 +1,19 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+import os
+import sys
+import importlib.util
+from glob import glob
+from array import array
+from collections import deque
 import log
 import inventory as inv
-from inventory import DatabaseError as StorageError
 import scheduler as sch
-from urllib.parse import urlencode
-import http.client as http_client
+import thingspeak
+
+PLUGINS_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'plugins')
+PLUGINS_PATTERN = 'actor_*.py'
 
 
 # Factory
@@ -23,10 +30,8 @@ def create_actor(cfg, aid=''):
         cfg_obj = inv.Actor.get_cfg_dict(cfg)
         actor_type = cfg_obj['type'].lower()
         try:
-            # prepare globals
-            globals_lower = {k.lower(): d for k, d in globals().items()}
-            # instantiate object
-            return globals_lower[actor_type](cfg_obj, str(aid))
+            # instantiate object of the registered class
+            return inv.Actor.types[actor_type](cfg_obj, str(aid))
         except KeyError:
             log.warning('Actor %s#%s could not be loaded - there is no appropriate class.' % (actor_type, aid))
     except ValueError:
@@ -36,9 +41,32 @@ def create_actor(cfg, aid=''):
     return None
 
 
+def load_plugins(directory: str=PLUGINS_DIRECTORY) -> list:
+    """
+    Import plugin modules (actor_*.py) from the directory - Actor classes defined there are registered
+    and could be created by create_actor() like built-in ones.
+    :return: names of modules imported
+    """
+    loaded = []
+    for path in sorted(glob(os.path.join(directory, PLUGINS_PATTERN))):
+        name = os.path.splitext(os.path.basename(path))[0]
+        if name in sys.modules:
+            continue
+        try:
+            spec = importlib.util.spec_from_file_location(name, path)
+            module = importlib.util.module_from_spec(spec)
+            sys.modules[name] = module
+            spec.loader.exec_module(module)
+            loaded.append(name)
+        except Exception as err:
+            sys.modules.pop(name, None)
+            log.warning('Plugin %s could not be loaded - %s.' % (path, err))
+    return loaded
+
+
 # Classes
 
-class ActorWithMapping(inv.Handler):
+class ActorWithMapping(inv.Handler, abstract=True):
     """ Actor using mapping data in config. """
     class MapUnit(inv.ConfigObject):
         """ Object used as a mapping record in ActorWithMapping configuration. """
@@ -58,6 +86,7 @@ class ActorWithMapping(inv.Handler):
         super().__init__(cfg, db_id)
         # mapping data
         self.mapping = {}
+        self.mapping_index = {}     # MapUnits by str(in) in the order of mapping (signals are looked up by it)
         self.init_mapping()
 
     def append_map_unit(self, map_cfg):
@@ -79,14 +108,27 @@ class ActorWithMapping(inv.Handler):
         if 'map' in self.config['data']:
             for map_cfg in self.config['data']['map']:
                 self.append_map_unit(map_cfg)
+        self.index_mapping()
+
+    def index_mapping(self):
+        """ Index mapping units by a signal matching them (units of '1' and 1 match the same signal). """
+        index = {}
+        for map_id, map_unit in self.mapping.items():
+            index.setdefault(str(map_id), []).append(map_unit)
+        self.mapping_index = {key: tuple(units) for key, units in index.items()}
+
+    def get_map_units(self, signal) -> tuple:
+        """ Get mapping units matching the signal (the last one wins). """
+        return self.mapping_index.get(str(signal), ())
 
     def apply_changes(self):
         """ Re-init mapping structure when changes done. """
         self.mapping = {}
         self.init_mapping()
+        super().apply_changes()
 
 
-class ActorLog(inv.Handler):
+class ActorLog(inv.Handler, abstract=True):
     """
     Actor logging source data with a period defined in ticks.
     The logging action [self.log(sig)] is defined in child classes.
@@ -132,15 +174,14 @@ class Resend(ActorWithMapping):
         except KeyError:
             target = None
         # Mapping values
-        for map_id in self.mapping:
-            if str(map_id) == str(signal):
-                map_unit_cfg = self.mapping[map_id].config
-                if 'out' in map_unit_cfg:
-                    out = map_unit_cfg['out']
-                try:
-                    target = {"nid": map_unit_cfg['trg'], "mal": map_unit_cfg['trg_mdl']}
-                except KeyError:
-                    pass
+        for map_unit in self.get_map_units(signal):
+            map_unit_cfg = map_unit.config
+            if 'out' in map_unit_cfg:
+                out = map_unit_cfg['out']
+            try:
+                target = {"nid": map_unit_cfg['trg'], "mal": map_unit_cfg['trg_mdl']}
+            except KeyError:
+                pass
         # Sending
         if target:
             try:
@@ -150,15 +191,22 @@ class Resend(ActorWithMapping):
 
 
 class LogThingSpeak(ActorWithMapping, ActorLog):
-    """ Log source data to ThingSpeak.com using mapping for complex signal. """
+    """
+    Log source data to ThingSpeak.com using mapping for complex signal.
+    Data is uploaded in background, bulk updates are used if 'channel' (ID) is defined.
+    """
     @classmethod
     def check_cfg(cls, cfg):
         super(LogThingSpeak, cls).check_cfg(cfg)
         return cfg['data']['key']
 
+    def __init__(self, cfg, db_id):
+        super().__init__(cfg, db_id)
+        self.uploader = thingspeak.get_uploader(self.config['data'].get('host', thingspeak.HOST))
+
     def log(self, signal):
         # Prepare
-        data_to_send = {'key': self.config['data']['key']}
+        data_to_send = {}
         if isinstance(signal, dict):
             for alias in signal:
                 try:
@@ -171,34 +219,19 @@ class LogThingSpeak(ActorWithMapping, ActorLog):
             except KeyError:
                 single_field = 'field1'     # default field
             data_to_send[single_field] = signal
-        # Send
-        connection = http_client.HTTPConnection("api.thingspeak.com:80")
-        connection.request(
-            "POST",
-            "/update",
-            urlencode(data_to_send),
-            {"Content-type": "application/x-www-form-urlencoded", "Accept": "text/plain"})
-        # Response
-        response = connection.getresponse()  # response.status, response.reason
-        if response.status != 200:
-            log.warning('%s cannot upload data, response: %d "%s"' % (self, response.status, response.reason))
+        # Send (in background)
+        self.uploader.put(self.config['data']['key'], data_to_send, self.config['data'].get('channel', ''))
 
 
 class LogDB(ActorLog):
-    """ Log source data to DB. """
+    """ Log source data to DB (stored by batches in background). """
+    def __init__(self, cfg, db_id):
+        super().__init__(cfg, db_id)
+        self.writer = inv.storage_writer("INSERT INTO sens_data (sensor, value) VALUES (%s, %s)")
+
     def log(self, signal):
         # Store value
-        cursor = inv.storage_open()
-        if cursor:
-            try:
-                cursor.execute(
-                    "INSERT INTO sens_data (sensor, value) VALUES (%s, %s)",
-                    (self.src_key, ActorLog.to_string(signal)))
-                inv.storage_save()
-            except StorageError:
-                pass
-            finally:
-                inv.storage_close(cursor)
+        self.writer.write((self.src_key, ActorLog.to_string(signal)))
 
 
 class LogBus(ActorWithMapping, ActorLog):
@@ -211,22 +244,79 @@ class LogBus(ActorWithMapping, ActorLog):
         except KeyError:
             target = None
         # Mapping values
-        for map_id in self.mapping:   # type: ActorWithMapping.MapUnit
-            if str(map_id) == str(signal):
-                map_unit_cfg = self.mapping[map_id].config
-                if 'out' in map_unit_cfg:
-                    out = map_unit_cfg['out']
-                try:
-                    target = map_unit_cfg['trg']
-                except KeyError:
-                    pass
+        for map_unit in self.get_map_units(signal):   # type: ActorWithMapping.MapUnit
+            map_unit_cfg = map_unit.config
+            if 'out' in map_unit_cfg:
+                out = map_unit_cfg['out']
+            try:
+                target = map_unit_cfg['trg']
+            except KeyError:
+                pass
         # Logging
         if target:
             inv.bus.send(target, out)
 
 
+class Window(object):
+    """
+    Series of the latest [depth] numbers aggregated by a function:
+    mean - running sum of numbers in a ring buffer,
+    min/max - monotonic queue of numbers which could become the extreme,
+    ema - exponential moving average with the smoothing period of [depth] numbers.
+    Every function costs O(1) (amortized for min/max) for a number whatever the depth is.
+    """
+    FUNCTIONS = ('mean', 'min', 'max', 'ema')
+
+    def __init__(self, depth: int, function: str='mean'):
+        self.depth = max(depth, 1)
+        self.function = function
+        self.count = 0                  # numbers added
+        self.result = 0.0
+        if function == 'mean':
+            self.numbers = array('d', bytes(8 * self.depth))    # ring buffer
+            self.sum = 0.0
+        elif function in ('min', 'max'):
+            self.extremes = deque()     # (index, number) - candidates for the extreme, the current one is the first
+        elif function == 'ema':
+            self.alpha = 2 / (self.depth + 1)
+        else:
+            raise ValueError("unknown function '%s'" % function)
+
+    def add(self, number: float) -> float:
+        index = self.count
+        self.count += 1
+        if self.function == 'mean':
+            position = index % self.depth
+            if index >= self.depth:
+                self.sum -= self.numbers[position]
+            self.numbers[position] = number
+            if position == self.depth - 1:
+                self.sum = sum(self.numbers)    # float errors are not accumulated (once a buffer turnover)
+            else:
+                self.sum += number
+            self.result = self.sum / min(self.count, self.depth)
+        elif self.function == 'ema':
+            self.result = number if index == 0 else self.result + self.alpha * (number - self.result)
+        else:
+            extremes = self.extremes
+            if self.function == 'min':
+                while extremes and extremes[-1][1] >= number:
+                    extremes.pop()
+            else:
+                while extremes and extremes[-1][1] <= number:
+                    extremes.pop()
+            extremes.append((index, number))
+            if extremes[0][0] <= index - self.depth:
+                extremes.popleft()
+            self.result = extremes[0][1]
+        return self.result
+
+
 class Average(inv.Handler):
-    """ Averages values on some period, defined by 'depth' parameter. """
+    """
+    Averages values on some period, defined by 'depth' parameter.
+    The aggregating function could be set by 'func' parameter: mean (default), min, max or ema.
+    """
     @classmethod
     def check_cfg(cls, cfg):
         super(Average, cls).check_cfg(cfg)
@@ -234,20 +324,22 @@ class Average(inv.Handler):
 
     def __init__(self, cfg, db_id):
         super().__init__(cfg, db_id)
-        self.__data = {}    # to store history sets per entity (entity_name: entity_set)
+        self.__data = {}    # to store history windows per entity (entity_name: Window)
         # default Depth if it is not set
         if 'depth' not in self.config['data']:
             self.config['data']['depth'] = 5
+        if self.config['data'].get('func', 'mean') not in Window.FUNCTIONS:
+            log.warning('Unknown function %s of %s, mean is used.' % (self.config['data']['func'], self))
+            self.config['data']['func'] = 'mean'
 
     def __calc(self, key: str, number: float) -> str:
-        if key not in self.__data:
-            self.__data[key] = []
-        self.__data[key].append(number)
-        # the length of averaged stack should not exceed depth value
-        if len(self.__data[key]) > int(self.config['data']['depth']):
-            self.__data[key].pop(0)
+        try:
+            window = self.__data[key]
+        except KeyError:
+            window = self.__data[key] = Window(int(self.config['data']['depth']),
+                                               self.config['data'].get('func', 'mean'))
         # calc average values
-        return '%.1f' % (sum([float(value) for value in self.__data[key]]) / len(self.__data[key]))
+        return '%.1f' % window.add(number)
 
     def process_signal(self, sig):
         """
@@ -263,7 +355,14 @@ class Average(inv.Handler):
                 averaged_sig[key] = self.__calc(key, float(sig[key]))
             self.box.value = averaged_sig
         elif isinstance(sig, (int, float, str)):
-            self.box.value = self.__calc('.', sig)
+            self.box.value = self.__calc('.', float(sig))
+
+    def apply_changes(self):
+        """ Series are started again as depth or function could be changed. """
+        if self.config['data'].get('func', 'mean') not in Window.FUNCTIONS:
+            self.config['data']['func'] = 'mean'
+        self.__data = {}
+        super().apply_changes()
 
 
 class Schedule(inv.Generator):
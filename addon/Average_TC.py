@@ -0,0 +1,49 @@
+import unittest
+import random
+from actors import Window, create_actor
+
+
+class WindowTestCases(unittest.TestCase):
+    def setUp(self):
+        random.seed(13)
+        self.numbers = [random.uniform(-100, 100) for _ in range(1000)]
+
+    def check(self, function, depth, reference):
+        window = Window(depth, function)
+        for i, number in enumerate(self.numbers):
+            expected = reference(self.numbers[max(0, i + 1 - depth):i + 1])
+            self.assertAlmostEqual(window.add(number), expected, 6)
+
+    def test01_mean(self):
+        self.check('mean', 7, lambda numbers: sum(numbers) / len(numbers))
+        self.check('mean', 1, lambda numbers: numbers[-1])
+
+    def test02_min(self):
+        self.check('min', 10, min)
+
+    def test03_max(self):
+        self.check('max', 10, max)
+
+    def test04_ema(self):
+        window = Window(3, 'ema')
+        self.assertEqual(window.add(10), 10)
+        self.assertEqual(window.add(20), 15)    # alpha = 2 / (3 + 1)
+        self.assertEqual(window.add(20), 17.5)
+
+    def test05_unknownFunction(self):
+        with self.assertRaises(ValueError):
+            Window(3, 'median')
+
+
+class AverageTestCases(unittest.TestCase):
+    def test01_processSignal(self):
+        actor = create_actor({"type": "average", "data": {"src": "1", "box": "Max", "depth": 2, "func": "max"}}, '1')
+        for value, expected in [("5", '5.0'), ("7", '7.0'), ("3", '7.0'), ("2", '3.0')]:
+            actor.process_signal(value)
+            self.assertEqual(actor.box.value, expected)
+        actor.process_signal({"t": "1", "h": "40"})
+        self.assertEqual(actor.box.value, {"t": '1.0', "h": '40.0'})
+
+
+if __name__ == '__main__':
+    unittest.main()
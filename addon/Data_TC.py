@@ -0,0 +1,57 @@
+import unittest
+import json
+from time import sleep
+import inventory as inv
+from actors import create_actor
+from manager import request_manage_data
+
+
+class BoxDataTestCases(unittest.TestCase):
+    def setUp(self):
+        self.average = create_actor({"type": "average", "data": {"src": "BD01", "src_mdl": "T", "box": "A"}}, 'bd1')
+        self.resend = create_actor({"type": "resend", "data": {"src": "BD02", "src_mdl": "T", "box": "R"}}, 'bd2')
+        inv.register_actor(self.average)
+        inv.register_actor(self.resend)
+
+    def tearDown(self):
+        inv.wipe_actor(self.average)
+        inv.wipe_actor(self.resend)
+
+    def test01_snapshot(self):
+        self.average.box.value = '21.5'
+        self.assertEqual(inv.box_values['BD01/T']['A'], '21.5')
+        encoded = inv.get_box_values_json()
+        self.assertIs(inv.get_box_values_json(), encoded)    # nothing has been set
+        self.average.box.value = '22.0'
+        self.assertEqual(json.loads(inv.get_box_values_json())['BD01/T']['A'], '22.0')
+        data = json.loads(request_manage_data({"request": "get-data"}, True))
+        self.assertEqual(data['boxes']['BD01/T'], {'A': '22.0'})
+        self.assertIn('nodes-alive', data)
+
+    def test02_filters(self):
+        self.average.box.value = '1'
+        self.resend.box.value = '2'
+        data = request_manage_data({"params": {"node": "BD01"}})
+        self.assertEqual(data['boxes'], {'BD01/T': {'A': '1'}})
+        data = request_manage_data({"params": {"type": "resend"}})
+        self.assertEqual(data['boxes'], {'BD02/T': {'R': '2'}})
+        data = request_manage_data({"params": ["BD01/T", "unknown"]})   # Box keys
+        self.assertEqual(data['boxes'], {'BD01/T': {'A': '1'}})
+        since = data['time']
+        sleep(0.01)
+        self.resend.box.value = '3'
+        data = request_manage_data({"params": {"since": since, "keys": ["BD01/T", "BD02/T"]}})
+        self.assertEqual(data['boxes'], {'BD02/T': {'R': '3'}})
+
+    def test03_pagination(self):
+        data = request_manage_data({"params": {"keys": ["BD01/T", "BD02/T"], "offset": 1, "limit": 1}})
+        self.assertEqual(data['total'], 2)
+        self.assertEqual(list(data['boxes']), ['BD02/T'])
+
+    def test04_wrongParams(self):
+        for params in ({"since": "yesterday"}, {"limit": "all"}, {"offset": -1}, {"keys": "BD01/T"}):
+            self.assertIn('nack', request_manage_data({"params": params}))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,54 @@
+import unittest
+import inventory as inv
+from bus import parse_message
+from Handlers_TC import create_handler
+
+
+class DeadbandTestCases(unittest.TestCase):
+    def setUp(self):
+        self.node = inv.register_node({"id": "DB0001", "ver": "1"})
+        self.dht = inv.register_module(self.node, {"t": "4", "a": "DHT", "p": "4", "prd": "60"})
+        self.timer = inv.register_module(self.node, {"t": "1", "a": "TMR", "p": "5", "prd": "60", "dband": "2"})
+        self.switch = inv.register_module(self.node, {"t": "51", "a": "SW", "p": "2"})
+        self.handler = create_handler('db1', 'DB0001', 'DHT')
+        self.switch_handler = create_handler('db2', 'DB0001', 'SW')
+        inv.register_actor(self.handler)
+        inv.register_actor(self.switch_handler)
+
+    def tearDown(self):
+        inv.wipe_actor(self.handler)
+        inv.wipe_actor(self.switch_handler)
+        del inv.nodes[self.node.id]
+        for module in self.node.modules.values():
+            if module.alive_timer:
+                module.alive_timer.cancel()
+            inv.boxes.pop(module.src_key, None)
+            inv.box_values.pop(module.src_key, None)
+
+    def test01_fields(self):
+        self.dht.handle_data(parse_message('{t:21.5,h:40}'))
+        self.dht.handle_data(parse_message('{t:21.55,h:40}'))     # below the deadband of the type
+        self.dht.handle_data(parse_message('{t:21.5,h:40}'))
+        self.assertEqual(len(self.handler.signals), 1)
+        self.dht.handle_data(parse_message('{t:21.65,h:40}'))
+        self.dht.handle_data(parse_message('{t:21.65}'))           # fields have changed
+        self.assertEqual(self.handler.signals[1:], [{"t": "21.65", "h": "40"}, {"t": "21.65"}])
+        self.assertEqual(self.dht.box.value, {"t": "21.65"})
+
+    def test02_configured(self):
+        self.timer.handle_data(parse_message('10'))
+        self.timer.handle_data(parse_message('11'))
+        self.assertEqual(self.timer.box.value, 10)
+        self.timer.handle_data(parse_message('12'))                # the deadband is counted from the value handled
+        self.assertEqual(self.timer.box.value, 12)
+        self.timer.handle_data(parse_message('off'))
+        self.assertEqual(self.timer.box.value, 'off')
+
+    def test03_notPeriodic(self):
+        self.switch.handle_data('1')
+        self.switch.handle_data('1')                      # Actuator states are handled always
+        self.assertEqual(self.switch_handler.signals, ['1', '1'])
+
+
+if __name__ == '__main__':
+    unittest.main()
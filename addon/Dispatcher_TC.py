@@ -0,0 +1,64 @@
+import unittest
+from threading import Event
+from dispatcher import Dispatcher
+import bus
+
+
+class DispatcherTestCases(unittest.TestCase):
+    def test01_orderPerKey(self):
+        dispatcher = Dispatcher(4, 1000)
+        processed = {}
+
+        def handle(key, number):
+            processed.setdefault(key, []).append(number)
+
+        for number in range(200):
+            for key in ('N1', 'N2', 'N3'):
+                self.assertTrue(dispatcher.submit(key, handle, key, number))
+        dispatcher.stop()
+        for key in ('N1', 'N2', 'N3'):
+            self.assertEqual(processed[key], list(range(200)))
+        self.assertEqual(dispatcher.get_stats()['dispatched'], 600)
+        self.assertEqual(dispatcher.get_stats()['dropped'], 0)
+
+    def test02_overflow(self):
+        dispatcher = Dispatcher(1, 2)
+        started, release = Event(), Event()
+
+        def occupy():
+            started.set()
+            release.wait()
+
+        dispatcher.submit('N1', occupy)     # occupy the only worker
+        started.wait()
+        results = [dispatcher.submit('N1', len, 'x') for _ in range(5)]
+        stats = dispatcher.get_stats()
+        self.assertEqual(results, [True, True, False, False, False])
+        self.assertEqual(stats['dropped'], results.count(False))
+        self.assertEqual(stats['queued'], 2)
+        release.set()
+        dispatcher.stop()
+        self.assertEqual(dispatcher.get_stats()['queued'], 0)
+
+    def test03_workerSurvivesError(self):
+        dispatcher = Dispatcher(1, 10)
+        done = []
+        dispatcher.submit('N1', int, 'not a number')
+        dispatcher.submit('N1', done.append, 1)
+        dispatcher.stop()
+        self.assertEqual(done, [1])
+
+    def test04_topicRoutes(self):
+        trie = bus.TopicTrie()
+        for pattern in ['/data/+/+', '/nodes/+', '/manager', '/data/N1/IR', '/log/#']:
+            trie.add(pattern, pattern)
+        self.assertEqual(trie.match('/data/I23456/IR'), ('/data/+/+', ['I23456', 'IR']))
+        self.assertEqual(trie.match('/data/N1/IR'), ('/data/N1/IR', []))     # exact levels win
+        self.assertEqual(trie.match('/nodes/I23456'), ('/nodes/+', ['I23456']))
+        self.assertEqual(trie.match('/manager'), ('/manager', []))
+        self.assertEqual(trie.match('/log/a/b'), ('/log/#', ['a/b']))
+        self.assertEqual(trie.match('/nodes/I23456/x'), (None, None))
+        self.assertEqual(trie.match('/manager/1'), (None, None))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,114 @@
+import unittest
+import inventory as inv
+
+
+class RecordHandler(inv.Handler, abstract=True):    # test double - not an Actor type
+    """ Handler recording signals and appending its id to the value of its Box. """
+    def __init__(self, cfg, aid):
+        super().__init__(cfg, aid)
+        self.signals = []
+
+    def process_signal(self, sig):
+        self.signals.append(sig)
+        self.box.value = '%s>%s' % (sig, self.id)
+
+
+def create_handler(aid: str, src: str, src_mdl: str=None) -> RecordHandler:
+    data = {"src": src, "box": "Plan %s" % aid}
+    if src_mdl:
+        data['src_mdl'] = src_mdl
+    return RecordHandler({"type": "record", "data": data}, aid)
+
+
+class HandlerPlanTestCases(unittest.TestCase):
+    def setUp(self):
+        self.chain = []
+
+    def tearDown(self):
+        for actor in self.chain:
+            inv.wipe_actor(actor)
+
+    def register(self, actor):
+        inv.register_actor(actor)
+        self.chain.append(actor)
+        return actor
+
+    def test01_chain(self):
+        first = self.register(create_handler('p1', 'PLAN01', 'M'))
+        second = self.register(create_handler('p2', 'p1'))
+        third = self.register(create_handler('p3', 'p1'))
+        fourth = self.register(create_handler('p4', 'p2'))
+        self.assertEqual([(actor.id, parent) for actor, parent in inv.get_handler_plan('PLAN01/M')],
+                         [('p1', -1), ('p2', 0), ('p4', 1), ('p3', 0)])
+        inv.handle_value('PLAN01/M', 'v')
+        self.assertEqual(first.signals, ['v'])
+        self.assertEqual(second.signals, ['v>p1'])
+        self.assertEqual(third.signals, ['v>p1'])
+        self.assertEqual(fourth.signals, ['v>p1>p2'])
+
+    def test02_recompiledOnChange(self):
+        first = self.register(create_handler('p1', 'PLAN02', 'M'))
+        second = self.register(create_handler('p2', 'p1'))
+        plan = inv.get_handler_plan('PLAN02/M')
+        self.assertIs(inv.get_handler_plan('PLAN02/M'), plan)     # plan is cached
+        first.set_active(False)
+        self.assertEqual(inv.get_handler_plan('PLAN02/M'), ())     # chain is cut by the inactive Handler
+        first.set_active(True)
+        self.register(create_handler('p3', 'p2'))
+        self.assertEqual(len(inv.get_handler_plan('PLAN02/M')), 3)
+        self.assertEqual(second.signals, [])
+
+    def test03_longestChain(self):
+        self.register(create_handler('d0', 'PLAN03', 'M'))
+        for i in range(1, inv.CHAIN_DEPTH_MAX):
+            self.register(create_handler('d%d' % i, 'd%d' % (i - 1)))
+        inv.handle_value('PLAN03/M', 'v')   # the chain is run without recursion
+        self.assertEqual(self.chain[-1].signals, ['v' + ''.join('>d%d' % i for i in range(inv.CHAIN_DEPTH_MAX - 1))])
+
+
+class ActorChainTestCases(unittest.TestCase):
+    def setUp(self):
+        self.chain = []
+
+    def tearDown(self):
+        for actor in self.chain:
+            inv.wipe_actor(actor)
+
+    def register(self, actor):
+        inv.register_actor(actor)
+        self.chain.append(actor)
+        return actor
+
+    def test01_loopRejected(self):
+        self.register(create_handler('c1', 'c2'))   # the source is not loaded yet
+        with self.assertRaises(inv.ActorError):
+            inv.register_actor(create_handler('c2', 'c1'))
+        with self.assertRaises(inv.ActorError):
+            inv.register_actor(create_handler('c3', 'c3'))
+        self.assertNotIn('c2', inv.actors)
+
+    def test02_depthLimit(self):
+        self.register(create_handler('c0', 'CHAIN02', 'M'))
+        for i in range(1, inv.CHAIN_DEPTH_MAX):
+            self.register(create_handler('c%d' % i, 'c%d' % (i - 1)))
+        with self.assertRaises(inv.ActorError):
+            inv.register_actor(create_handler('c%d' % inv.CHAIN_DEPTH_MAX, 'c%d' % (inv.CHAIN_DEPTH_MAX - 1)))
+
+    def test03_moveSource(self):
+        first = self.register(create_handler('c1', 'CHAIN03', 'M'))
+        second = self.register(create_handler('c2', 'c1'))
+        third = self.register(create_handler('c3', 'c2'))
+        with self.assertRaises(inv.ActorError):
+            inv.set_actor_source(first, {'src': 'c3', 'src_mdl': ''})
+        self.assertEqual(first.config['data']['src'], 'CHAIN03')   # rejected change is not applied
+        inv.set_actor_source(second, {'src': 'CHAIN03B', 'src_mdl': 'M'})
+        self.assertEqual(third.src_key, 'CHAIN03B/M')
+        self.assertIn(third.box.name, inv.boxes['CHAIN03B/M'])
+        self.assertNotIn(third.box.name, inv.boxes['CHAIN03/M'])
+        inv.handle_value('CHAIN03B/M', 'v')
+        self.assertEqual(third.signals, ['v>c2'])
+        self.assertEqual(first.signals, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+import unittest
+import os
+import tempfile
+from time import time, ctime
+import log
+
+
+class LogTestCases(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.logfile = os.path.join(self.directory.name, 'khome.log')
+        self.rotate_size = log.ROTATE_SIZE
+
+    def tearDown(self):
+        log.stop()
+        log.ROTATE_SIZE = self.rotate_size
+        log.init()
+        self.directory.cleanup()
+
+    def read(self, path):
+        with open(path) as file:
+            return file.read()
+
+    def test01_level(self):
+        log.init(self.logfile, log.WARNING)
+        log.debug('debug')
+        log.info('info')
+        log.warning('warning')
+        log.error('error')
+        log.stop()
+        records = self.read(self.logfile).splitlines()
+        self.assertEqual(len(records), 2)
+        self.assertTrue(records[0].endswith('<-WARN-> warning'))
+        self.assertTrue(records[1].endswith('<!ERROR!> error'))
+
+    def test02_rotation(self):
+        log.ROTATE_SIZE = 100
+        log.init(self.logfile)
+        for i in range(40):
+            log.info('message %d' % i)
+        log.stop()
+        self.assertEqual(sorted(os.listdir(self.directory.name)),
+                         ['khome.log'] + ['khome.log.%d' % i for i in range(1, log.ROTATE_COUNT + 1)])
+        self.assertTrue(self.read(self.logfile).splitlines()[-1].endswith('message 39'))
+        self.assertNotIn('message 0', self.read(self.logfile + '.%d' % log.ROTATE_COUNT))  # the oldest are removed
+
+    def test03_busSampling(self):
+        log.init(self.logfile, bus_sampling=0)
+        log.bus_income('/nodes/1', 'hello')
+        log.bus_outcome('/config/1', '{}')
+        log.info('info')
+        log.stop()
+        self.assertEqual(len(self.read(self.logfile).splitlines()), 1)     # bus messages are not logged
+
+    def test04_reopenOnInit(self):
+        log.init(self.logfile)
+        log.info('first')
+        other = os.path.join(self.directory.name, 'other.log')
+        log.init(other)
+        log.info('second')
+        log.stop()
+        self.assertTrue(self.read(self.logfile).strip().endswith('first'))
+        self.assertTrue(self.read(other).strip().endswith('second'))
+
+    def test05_rotationByAge(self):
+        with open(self.logfile, 'w') as file:
+            file.write('%s <+INFO+> old\n' % ctime(time() - log.ROTATE_PERIOD - 60))
+        log.init(self.logfile)
+        log.info('new')     # the file is older than the period though it has been opened just now
+        log.stop()
+        self.assertIn('old', self.read(self.logfile + '.1'))
+        self.assertTrue(self.read(self.logfile).strip().endswith('new'))
+
+
+if __name__ == '__main__':
+    unittest.main()
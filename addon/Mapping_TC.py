@@ -0,0 +1,24 @@
+import unittest
+from actors import create_actor
+
+
+class MappingTestCases(unittest.TestCase):
+    def setUp(self):
+        self.actor = create_actor({"type": "resend", "data": {"src": "1", "src_mdl": "IR", "map": [
+            {"in": "20df8976", "out": "1", "trg": "N1", "trg_mdl": "R"},
+            {"in": 15, "out": "2"},
+            {"in": "15", "out": "3", "trg": "N2", "trg_mdl": "R"}]}}, '1')
+
+    def test01_lookup(self):
+        self.assertEqual([unit.config['out'] for unit in self.actor.get_map_units('20df8976')], ['1'])
+        self.assertEqual([unit.config['out'] for unit in self.actor.get_map_units(15)], ['2', '3'])  # the last wins
+        self.assertEqual(self.actor.get_map_units('unknown'), ())
+
+    def test02_reindexOnChanges(self):
+        self.actor.config['data']['map'].append({"in": "ff", "out": "4"})
+        self.actor.apply_changes()
+        self.assertEqual([unit.config['out'] for unit in self.actor.get_map_units('ff')], ['4'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,99 @@
+import unittest
+from time import monotonic
+from threading import Condition, Event
+from onboarding import Onboarding, TokenBucket
+
+
+class OnboardingTestCases(unittest.TestCase):
+    def setUp(self):
+        self.condition = Condition()
+        self.nodes = []             # (nid, hello) of handshakes started
+        self.running = 0
+        self.running_max = 0
+        self.failures = 0           # handshakes to be failed before the first success
+        self.release = Event()      # handshakes wait for it
+        self.release.set()
+        self.onboardings = []
+
+    def tearDown(self):
+        self.release.set()
+        for onboarding in self.onboardings:
+            onboarding.stop(1)
+
+    def create(self, concurrency: int=1, retries: int=0) -> Onboarding:
+        onboarding = Onboarding(self.handshake, concurrency, 1000, 1000, retries, 0.01)
+        self.onboardings.append(onboarding)
+        return onboarding
+
+    def handshake(self, nid, hello) -> bool:
+        with self.condition:
+            self.nodes.append((nid, hello))
+            self.running += 1
+            self.running_max = max(self.running, self.running_max)
+            self.condition.notify_all()
+        self.release.wait()
+        with self.condition:
+            self.running -= 1
+            is_failed = self.failures > 0
+            self.failures -= is_failed
+        return not is_failed
+
+    def wait_running(self, running: int):
+        with self.condition:
+            self.assertTrue(self.condition.wait_for(lambda: self.running == running, 5))
+
+    def test01_concurrency(self):
+        onboarding = self.create(2)
+        self.release.clear()
+        for i in range(8):
+            onboarding.admit('N%d' % i, {"id": "N%d" % i})
+        self.wait_running(2)
+        self.assertEqual(onboarding.get_stats()['pending'], 6)
+        self.release.set()
+        self.assertTrue(onboarding.join(5))
+        self.assertEqual(len(self.nodes), 8)
+        self.assertEqual(self.running_max, 2)
+        self.assertEqual(onboarding.get_stats()['done'], 8)
+
+    def test02_rate(self):
+        bucket = TokenBucket(20, 2)
+        started = monotonic()
+        for _ in range(6):
+            bucket.acquire()
+        self.assertGreaterEqual(monotonic() - started, 0.19)     # 2 at once, 4 more at 20 per second
+        with self.assertRaises(ValueError):
+            TokenBucket(0, 1)
+
+    def test03_retry(self):
+        self.failures = 2
+        onboarding = self.create(retries=3)
+        onboarding.admit('R1', {"id": "R1"})
+        self.assertTrue(onboarding.join(5))
+        self.assertEqual(len(self.nodes), 3)
+        self.assertEqual(onboarding.get_stats(),
+                         {"pending": 0, "active": 0, "done": 1, "retried": 2, "failed": 0})
+
+    def test04_retriesExhausted(self):
+        self.failures = 5
+        onboarding = self.create(retries=1)
+        onboarding.admit('R2', {"id": "R2"})
+        self.assertTrue(onboarding.join(5))
+        self.assertEqual(len(self.nodes), 2)
+        self.assertEqual(onboarding.failed, 1)
+
+    def test05_latestHello(self):
+        onboarding = self.create(2)
+        self.release.clear()
+        onboarding.admit('H1', 'first')
+        self.wait_running(1)
+        onboarding.admit('H1', 'second')    # waits for the handshake in progress
+        onboarding.admit('H1', 'third')
+        self.assertEqual(onboarding.get_stats()['pending'], 1)
+        self.release.set()
+        self.assertTrue(onboarding.join(5))
+        self.assertEqual(self.nodes, [('H1', 'first'), ('H1', 'third')])
+        self.assertEqual(self.running_max, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,40 @@
+import unittest
+from time import sleep
+import bus
+
+
+class OutboundTestCases(unittest.TestCase):
+    def tearDown(self):
+        bus.remove_outbound('/retained/#')
+
+    def test01_coalesce(self):
+        published = bus.get_stats()['outbound']['published']
+        first = bus.post('/signal/OUT01/SW', '1')
+        self.assertIs(bus.post('/signal/OUT01/SW', {"v": 2}, True), first)
+        self.assertIsNot(bus.post('/signal/OUT01/IR', '3'), first)
+        self.assertEqual(first.message, '{v:2}')
+        self.assertEqual(first.coalesced, 1)
+        self.assertEqual(bus.get_stats()['outbound']['published'], published)
+        sleep(bus.COALESCE_WINDOW + 0.2)
+        self.assertEqual(bus.get_stats()['outbound']['published'], published + 2)
+        self.assertIsNot(bus.post('/signal/OUT01/SW', '4'), first)     # the window is over
+
+    def test02_policy(self):
+        bus.outbound('/retained/#', qos=1, retain=True)
+        first = bus.post('/retained/OUT02', '1')
+        self.assertIsNot(bus.post('/retained/OUT02', '2'), first)   # sent at once
+        self.assertEqual((first.policy.qos, first.policy.retain), (1, True))
+        self.assertEqual(bus.post('/config/OUT02', '3').policy.window, 0)
+        bus.remove_outbound('/retained/#')
+        self.assertEqual(bus.post('/retained/OUT02', '4').policy.qos, 0)
+
+    def test03_flushAll(self):
+        waiting = bus.get_stats()['outbound']['waiting']
+        bus.post('/signal/OUT03/SW', '1')
+        self.assertEqual(bus.get_stats()['outbound']['waiting'], waiting + 1)
+        bus.flush_all()
+        self.assertEqual(bus.get_stats()['outbound']['waiting'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,32 @@
+import unittest
+import bus
+
+
+class ParserTestCases(unittest.TestCase):
+    def test01_compact(self):
+        self.assertEqual(bus.parse_message('{id:I23456,modules:[{mal:TEMP,type:dht},{mal:IR,type:ir}]}'),
+                         {"id": "I23456", "modules": [{"mal": "TEMP", "type": "dht"}, {"mal": "IR", "type": "ir"}]})
+        self.assertEqual(bus.parse_message('{a:[1,[2,[3]]],b:{},c:}'), {"a": ["1", ["2", ["3"]]], "b": {}, "c": ""})
+        self.assertEqual(bus.parse_message('[]'), [])
+
+    def test02_valuesAreStrings(self):
+        self.assertEqual(bus.parse_message('{t:21.5,h:40}'), {"t": "21.5", "h": "40"})
+        self.assertEqual(bus.parse_message('{a:[{b:1},{c:2}]}'), {"a": [{"b": "1"}, {"c": "2"}]})
+        self.assertEqual(bus.parse_message('[1]'), ['1'])
+        long_message = '{%s}' % ','.join('m%d:[%d]' % (i, i) for i in range(40))   # the same way for any length
+        self.assertEqual(bus.parse_message(long_message), {'m%d' % i: [str(i)] for i in range(40)})
+
+    def test03_plainAndJson(self):
+        self.assertEqual(bus.parse_message('20df8976'), '20df8976')
+        self.assertEqual(bus.parse_message('{"session": "1", "request": "get-structure"}'),
+                         {"session": "1", "request": "get-structure"})
+
+    def test04_malformed(self):
+        for message, position in [('{a:1', 4), ('{a:1}}', 5), ('{a}', 2), ('[{a:1}{b:2}]', 6), ('{a:1]', 4), ('[:]', 1)]:
+            with self.assertRaises(bus.MessageFormatError) as context:
+                bus.parse_message(message)
+            self.assertEqual(context.exception.position, position)
+
+
+if __name__ == '__main__':
+    unittest.main()
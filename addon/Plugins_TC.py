@@ -0,0 +1,57 @@
+import unittest
+import os
+import sys
+import tempfile
+import inventory as inv
+from actors import create_actor, load_plugins, PLUGINS_DIRECTORY
+
+PLUGIN = '''
+import inventory as inv
+
+
+class Echo(inv.Handler):
+    def process_signal(self, sig):
+        self.box.value = sig
+'''
+
+
+class PluginsTestCases(unittest.TestCase):
+    def setUp(self):
+        self.types = dict(inv.Actor.types)
+
+    def tearDown(self):
+        # Actor types registered by the tests must not be seen by other tests
+        inv.Actor.types.clear()
+        inv.Actor.types.update(self.types)
+        sys.modules.pop('actor_echo_tc', None)
+
+    def test01_builtInTypes(self):
+        for actor_type in ['resend', 'average', 'logdb', 'schedule']:
+            self.assertIn(actor_type, inv.Actor.types)
+        self.assertNotIn('window', inv.Actor.types)     # not an Actor
+        for base in ['handler', 'generator', 'actorwithmapping', 'actorlog', 'recordhandler']:
+            self.assertNotIn(base, inv.Actor.types)
+        self.assertIsNone(create_actor({"type": "window", "data": {}}, '1'))
+
+    def test02_loadPlugin(self):
+        with tempfile.TemporaryDirectory() as directory:
+            with open(os.path.join(directory, 'actor_echo_tc.py'), 'w') as file:
+                file.write(PLUGIN)
+            with open(os.path.join(directory, 'actor_broken_tc.py'), 'w') as file:
+                file.write('raise ImportError("broken")')
+            self.assertEqual(load_plugins(directory), ['actor_echo_tc'])
+        actor = create_actor({"type": "echo", "data": {"src": "1", "box": "Echo"}}, '1')
+        self.assertEqual(actor.__class__.__name__, 'Echo')
+
+    def test04_pluginsNotInTests(self):
+        self.assertNotEqual(os.path.normcase(os.path.dirname(os.path.abspath(__file__))),
+                            os.path.normcase(PLUGINS_DIRECTORY))
+
+    def test03_typeNotReplaced(self):
+        average = inv.Actor.types['average']
+        type('Average', (inv.Handler,), {})    # a plugin defining a built-in type
+        self.assertIs(inv.Actor.types['average'], average)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+import unittest
+from time import sleep, monotonic
+import asyncio
+from threading import Event, current_thread
+from runtime import TimerWheel
+
+
+class TimerWheelTestCases(unittest.TestCase):
+    def setUp(self):
+        self.wheel = TimerWheel(0.01, 8)
+
+    def test01_fire(self):
+        fired = Event()
+        start = monotonic()
+        timer = self.wheel.call_later(0.1, fired.set)  # more than one revolution
+        self.assertTrue(timer.is_scheduled())
+        self.assertTrue(fired.wait(1))
+        self.assertGreaterEqual(monotonic() - start, 0.09)
+        self.assertFalse(timer.is_scheduled())
+        self.assertEqual(self.wheel.count, 0)
+
+    def test02_cancel(self):
+        fired = []
+        timer = self.wheel.call_later(0.03, fired.append, 1)
+        timer.cancel()
+        sleep(0.1)
+        self.assertEqual(fired, [])
+        self.assertEqual(self.wheel.count, 0)
+
+    def test03_reschedule(self):
+        fired = []
+        timer = self.wheel.call_later(0.05, fired.append, 1)
+        for _ in range(5):
+            sleep(0.03)
+            timer.reschedule(0.05)   # push the deadline forward
+        self.assertEqual(fired, [])
+        self.assertEqual(self.wheel.count, 1)
+        sleep(0.15)
+        self.assertEqual(fired, [1])
+        timer.reschedule(0.01)       # schedule the fired timer again
+        sleep(0.1)
+        self.assertEqual(fired, [1, 1])
+
+    def test04_eventLoop(self):
+        fired = []
+        self.wheel.call_later(0.02, lambda: fired.append(current_thread()))    # scheduled before the loop ticks
+
+        async def main():
+            self.wheel.attach(asyncio.get_running_loop())
+            self.wheel.call_later(0.03, lambda: fired.append(current_thread()))
+            await asyncio.sleep(0.1)
+            self.wheel.detach()
+
+        asyncio.run(main())
+        self.assertEqual(fired, [current_thread(), current_thread()])   # both are fired by the loop
+
+
+if __name__ == '__main__':
+    unittest.main()
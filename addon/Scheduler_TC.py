@@ -0,0 +1,93 @@
+import unittest
+import datetime
+from threading import Event
+import scheduler as sch
+
+
+class RecordJob(sch.Job):
+    def __init__(self, start_time):
+        super().__init__('record')
+        self.start_time = start_time
+        self.processed = Event()
+
+    def process(self):
+        self.processed.set()
+
+
+class SchedulerTestCases(unittest.TestCase):
+    def setUp(self):
+        self.now = datetime.datetime(2026, 10, 16, 12, 30, 15)
+
+    def test01_nextTimeDaily(self):
+        self.assertEqual(sch.JobTime('01:05').get_next(self.now), datetime.datetime(2026, 10, 17, 1, 5, 0))
+        self.assertEqual(sch.JobTime('12:30.20').get_next(self.now), datetime.datetime(2026, 10, 16, 12, 30, 20))
+        self.assertEqual(sch.JobTime('12:30.15').get_next(self.now), datetime.datetime(2026, 10, 17, 12, 30, 15))
+
+    def test02_nextTimeHourly(self):
+        self.assertEqual(sch.JobTime('0').get_next(self.now), datetime.datetime(2026, 10, 16, 13, 0, 0))
+        self.assertEqual(sch.JobTime('45.30').get_next(self.now), datetime.datetime(2026, 10, 16, 12, 45, 30))
+
+    def test03_nextTimeMonthly(self):
+        self.assertEqual(sch.JobTime('31:08:00').get_next(self.now), datetime.datetime(2026, 10, 31, 8, 0, 0))
+        self.assertEqual(sch.JobTime('31:08:00').get_next(datetime.datetime(2026, 11, 1)),
+                         datetime.datetime(2026, 12, 31, 8, 0, 0))     # November has 30 days
+        self.assertEqual(sch.JobTime('02:29:10:00').get_next(self.now), datetime.datetime(2028, 2, 29, 10, 0, 0))
+
+    def test04_nextTimeOnce(self):
+        self.assertEqual(sch.JobTime('2027:01:01:00:00').get_next(self.now), datetime.datetime(2027, 1, 1))
+        self.assertIsNone(sch.JobTime('2025:01:01:00:00').get_next(self.now))
+        self.assertIsNone(sch.JobTime('02:30:10:00').get_next(self.now))     # there is no such day
+
+    def test05_intervalNextTime(self):
+        job = sch.IntervalEventJob('record', {"period": "0.30", "start": "0", "stop": "5", "value": "1"})
+        self.assertEqual(job.get_next_time(self.now), datetime.datetime(2026, 10, 16, 13, 0, 0))
+        self.assertEqual(job.get_next_time(datetime.datetime(2026, 10, 16, 13, 0, 0)),
+                         datetime.datetime(2026, 10, 16, 13, 0, 30))
+        self.assertEqual(job.get_next_time(datetime.datetime(2026, 10, 16, 13, 2, 10)),
+                         datetime.datetime(2026, 10, 16, 13, 2, 30))  # in the middle of the interval
+        self.assertEqual(job.get_next_time(datetime.datetime(2026, 10, 16, 13, 4, 45)),
+                         datetime.datetime(2026, 10, 16, 13, 5, 0))
+        self.assertEqual(job.get_next_time(datetime.datetime(2026, 10, 16, 13, 5, 0)),
+                         datetime.datetime(2026, 10, 16, 14, 0, 0))
+
+    def test06_intervalOccurrences(self):
+        job = sch.IntervalEventJob('record', {"period": "1", "start": "22:00", "stop": "02:00", "value": "1"})
+        occurrences = job.get_occurrences(self.now, 250)
+        self.assertEqual(len(occurrences), 250)
+        self.assertEqual(occurrences[0], datetime.datetime(2026, 10, 16, 22, 0, 0))
+        self.assertEqual(occurrences[120], datetime.datetime(2026, 10, 17, 0, 0, 0))    # over midnight
+        self.assertEqual(occurrences[240], datetime.datetime(2026, 10, 17, 2, 0, 0))
+        self.assertEqual(occurrences[241], datetime.datetime(2026, 10, 17, 22, 0, 0))   # next interval
+        self.assertEqual(job.get_next_time(datetime.datetime(2026, 10, 17, 1, 0, 30)),
+                         datetime.datetime(2026, 10, 17, 1, 1, 0))
+
+    def test07_process(self):
+        sch.clear('')
+        due = RecordJob(datetime.datetime.now() + datetime.timedelta(seconds=1))
+        later = RecordJob(datetime.datetime.now() + datetime.timedelta(hours=1))
+        obsolete = RecordJob(datetime.datetime.now() - datetime.timedelta(seconds=1))
+        self.assertIsNotNone(sch.add_job(later))
+        self.assertIsNotNone(sch.add_job(due))
+        self.assertIsNone(sch.add_job(obsolete))
+        self.assertIs(sch.get_timetable()[0][1], due)
+        sch.init_timer()
+        self.assertTrue(due.processed.wait(3))
+        self.assertFalse(later.processed.is_set())
+        self.assertEqual([job for _, job in sch.get_timetable()], [later])   # jobs to be done once are removed
+        sch.clear('record')
+        self.assertEqual(sch.get_timetable(), [])
+
+    def test08_previousMonthly(self):
+        self.assertEqual(sch.JobTime('31:08:00').get_previous(datetime.datetime(2026, 11, 30)),
+                         datetime.datetime(2026, 10, 31, 8, 0, 0))
+        self.assertEqual(sch.JobTime('31:08:00').get_previous(datetime.datetime(2027, 3, 30)),
+                         datetime.datetime(2027, 1, 31, 8, 0, 0))      # February has no 31st
+
+    def test09_timetableLimit(self):
+        from manager import request_manage_timetable
+        self.assertIn('nack', request_manage_timetable({"params": {"limit": "all"}}))
+        self.assertIn('timetable', request_manage_timetable({"params": {"limit": 10 ** 9}}))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+import unittest
+from threading import Timer
+import inventory as inv
+
+
+class SessionTestCases(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.timeout = inv.SESSION_TIMEOUT
+        inv.SESSION_TIMEOUT = 0.3
+        cls.node = inv.Node({"id": "S23456", "ver": "1"})
+
+    @classmethod
+    def tearDownClass(cls):
+        inv.SESSION_TIMEOUT = cls.timeout
+
+    def test01_concurrentRequests(self):
+        session = self.node.session
+        sw = session.send('/signal/S23456/SW', '1', response_topic='/data/S23456/SW')
+        ir = session.send('/signal/S23456/IR', '2', response_topic='/data/S23456/IR')
+        self.assertEqual(len(session.requests), 2)
+        self.assertTrue(session.resolve('/data/S23456/IR', 'ir-answer'))
+        self.assertTrue(session.resolve('/data/S23456/SW', 'sw-answer'))
+        self.assertEqual(ir.result(1), 'ir-answer')
+        self.assertEqual(sw.result(1), 'sw-answer')
+        self.assertFalse(session.active)
+
+    def test02_orderForSameTopic(self):
+        session = self.node.session
+        first = session.send('/config/S23456', {"get": "gpio"})
+        second = session.send('/config/S23456', {"ping": ""})
+        self.assertTrue(session.resolve('/nodes/S23456', 'first'))
+        self.assertTrue(session.resolve('/nodes/S23456', 'second'))
+        self.assertFalse(session.resolve('/nodes/S23456', 'unexpected'))
+        self.assertEqual(first.result(1), 'first')
+        self.assertEqual(second.result(1), 'second')
+
+    def test03_timeout(self):
+        session = self.node.session
+        self.assertEqual(session.start('/config/S23456', {"ping": ""}), inv.TIMEOUT_RESPONSE)
+        self.assertFalse(session.active)
+        self.assertFalse(self.node.is_alive)
+
+    def test04_inflightLimit(self):
+        session = inv.NodeSession(self.node, 1)
+        first = session.send('/config/S23456', {"ping": ""})
+        Timer(0.1, session.resolve, ('/nodes/S23456', 'first')).start()
+        second = session.send('/config/S23456', {"ping": ""})    # waits for the first one
+        self.assertEqual(first.result(0), 'first')
+        self.assertEqual(len(session.requests), 1)
+        session.requests[0].timeout_timer.cancel()      # the second one would never be completed
+        self.assertEqual(session.start('/config/S23456', {"ping": ""}), inv.BUSY_RESPONSE)
+        self.assertFalse(second.done())
+
+    def test05_coalescedSignals(self):
+        session = inv.NodeSession(self.node, 1)
+        first = session.send('/signal/S23456/SW', '1', response_topic='/data/S23456/SW')
+        second = session.send('/signal/S23456/SW', '0', response_topic='/data/S23456/SW')  # no free slot needed
+        self.assertIs(first, second)
+        self.assertEqual(session.request, '0')
+        self.assertTrue(session.resolve('/data/S23456/SW', 'sw-answer'))
+        self.assertEqual(second.result(1), 'sw-answer')
+        self.assertFalse(session.active)
+
+    def test06_noCrossTalk(self):
+        session = self.node.session
+        gpio = session.send('/config/S23456', {"get": "gpio"})
+        sw = session.send('/signal/S23456/SW', '1', response_topic='/data/S23456/SW')
+        self.assertFalse(session.resolve('/data/S23456/TEMP', '21.5'))     # periodic reading is not a response
+        self.assertTrue(session.resolve('/nodes/S23456', {"gpio": []}))
+        self.assertFalse(sw.done())     # Node message does not answer a signal
+        self.assertTrue(session.resolve('/data/S23456/SW', '1'))
+        self.assertEqual(gpio.result(1), {"gpio": []})
+        self.assertEqual(sw.result(1), '1')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+import unittest
+import os
+import json
+import tempfile
+import inventory as inv
+import snapshot
+
+NODE_CFG = {"id": "SN0001", "inf": {"ip": "192.168.1.71", "rssi": "-60"}}
+MODULE_CFGS = [{"a": "T", "t": "1", "p": "4", "name": "Temperature"},
+               {"a": "R", "t": "61", "p": "5", "name": "Relay"}]
+
+
+class SnapshotTestCases(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'snapshot.json')
+
+    def tearDown(self):
+        node = inv.nodes.pop(NODE_CFG['id'], None)
+        if node:
+            for mal in list(node.modules):
+                inv.boxes.pop(node.modules[mal].src_key, None)
+                inv.box_values.pop(node.modules[mal].src_key, None)
+        self.directory.cleanup()
+
+    def write(self, revision):
+        with open(self.path, 'w') as file:
+            json.dump({"version": snapshot.VERSION, "revision": revision, "time": 0,
+                       "nodes": [{"config": dict(NODE_CFG), "modules": [dict(cfg) for cfg in MODULE_CFGS]}],
+                       "boxes": {"SN0001/T": {inv.BOXNAME_MODULE: "21.5"}}}, file)
+
+    def test01_restore(self):
+        self.write(inv.revision + 5)
+        self.assertTrue(snapshot.load(self.path))
+        node = inv.nodes['SN0001']
+        self.assertFalse(node.reconciled)
+        self.assertFalse(node.is_alive)
+        self.assertEqual(sorted(node.modules), ['R', 'T'])
+        self.assertEqual(node.modules['T'].box.value, '21.5')
+        self.assertIsNone(inv.get_structure_delta(inv.revision - 1))   # older revisions get the whole structure
+
+    def test02_save(self):
+        self.write(inv.revision)
+        snapshot.load(self.path)
+        os.remove(self.path)
+        self.assertTrue(snapshot.save(self.path))
+        self.assertFalse(snapshot.save(self.path))     # nothing has been changed
+        with open(self.path) as file:
+            saved = json.load(file)
+        self.assertIn({"config": NODE_CFG, "modules": MODULE_CFGS}, saved['nodes'])
+        self.assertEqual(saved['boxes']['SN0001/T'][inv.BOXNAME_MODULE], '21.5')
+
+    def test03_reconcile(self):
+        self.write(inv.revision)
+        snapshot.load(self.path)
+        node = inv.refresh_node(dict(NODE_CFG, inf={"ip": "192.168.1.72", "rssi": "-50"}))
+        self.assertEqual(node.config['inf']['ip'], '192.168.1.72')
+        inv.reconcile_modules(node, [{"a": "T", "t": "1", "p": "14", "prd": "30"}, {"a": "L", "t": "62", "p": "2"}])
+        self.assertEqual(sorted(node.modules), ['L', 'T'])
+        self.assertEqual(node.modules['T'].config['p'], '14')
+        self.assertEqual(node.modules['T'].period, 30)
+        self.assertNotIn('SN0001/R', inv.boxes)
+        self.assertTrue(node.reconciled)
+        self.assertIsNone(inv.refresh_node(NODE_CFG))    # the Node is registered as usual now
+
+    def test04_missing(self):
+        self.assertFalse(snapshot.load(self.path))
+
+    def test05_directoryCreated(self):
+        self.write(inv.revision)
+        snapshot.load(self.path)
+        path = os.path.join(self.directory.name, 'khome', 'snapshot.json')
+        self.assertTrue(snapshot.save(path))
+        self.assertEqual(os.listdir(os.path.dirname(path)), ['snapshot.json'])
+
+    def test06_malformed(self):
+        with open(self.path, 'w') as file:
+            json.dump({"version": snapshot.VERSION, "revision": 1, "time": 0,
+                       "nodes": [{"config": dict(NODE_CFG), "modules": [dict(cfg) for cfg in MODULE_CFGS]}],
+                       "boxes": ["SN0001/T"]}, file)
+        self.assertFalse(snapshot.load(self.path))
+        self.assertNotIn(NODE_CFG['id'], inv.nodes)     # nothing is restored
+
+    def test07_localFile(self):
+        # the snapshot is found whatever the working directory of the Manager is
+        self.assertTrue(os.path.isabs(snapshot.LOCAL_FILE))
+        self.assertEqual(os.path.dirname(snapshot.LOCAL_FILE), os.path.dirname(os.path.abspath(snapshot.__file__)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,112 @@
+import unittest
+from time import sleep
+import inventory as inv
+
+
+class ListWriter(inv.StorageWriter):
+    def __init__(self, *args, **kwargs):
+        super().__init__("INSERT INTO t (a) VALUES (%s)", *args, **kwargs)
+        self.batches = []
+        self.available = True
+
+    def store(self, rows: list) -> bool:
+        if self.available:
+            self.batches.append(rows)
+        return self.available
+
+
+class FakeConnection(object):
+    def __init__(self):
+        self.open = True
+        self.pings = 0
+        self.rollbacks = 0
+
+    def ping(self, reconnect=False):
+        self.pings += 1
+        self.open = True
+
+    def rollback(self):
+        if not self.open:
+            raise inv.DatabaseError('Connection is closed')
+        self.rollbacks += 1
+
+    def close(self):
+        self.open = False
+
+
+class StoragePoolTestCases(unittest.TestCase):
+    def test01_reuse(self):
+        pool = inv.StoragePool(FakeConnection, 2, 0.1)
+        first = pool.checkout()
+        second = pool.checkout()
+        self.assertIsNot(first, second)
+        self.assertIsNone(pool.checkout())      # pool is exhausted - checkout timeout
+        pool.checkin(first)
+        self.assertIs(pool.checkout(), first)
+
+    def test02_dropBroken(self):
+        pool = inv.StoragePool(FakeConnection, 1, 0.1)
+        broken = pool.checkout()
+        broken.open = False     # server has gone away
+        pool.checkin(broken)
+        self.assertIsNot(pool.checkout(), broken)
+
+    def test03_healthCheck(self):
+        pool = inv.StoragePool(FakeConnection, 1, 0.1, ping_period=0.05)
+        connection = pool.checkout()
+        pool.checkin(connection)
+        self.assertIs(pool.checkout(), connection)
+        self.assertEqual(connection.pings, 0)
+        pool.checkin(connection)
+        sleep(0.1)
+        self.assertIs(pool.checkout(), connection)
+        self.assertEqual(connection.pings, 1)   # idle connection is checked
+
+    def test04_rollbackOnCheckin(self):
+        pool = inv.StoragePool(FakeConnection, 1, 0.1)
+        connection = pool.checkout()
+        pool.checkin(connection)
+        self.assertEqual(connection.rollbacks, 1)   # transaction of the borrower is not left open
+
+
+class StorageWriterTestCases(unittest.TestCase):
+    def test01_batchBySize(self):
+        writer = ListWriter(batch_size=10, flush_period=5)
+        for i in range(25):
+            self.assertTrue(writer.write((i,)))
+        sleep(0.2)
+        self.assertEqual([len(batch) for batch in writer.batches], [10, 10])
+        writer.stop()   # the rest is flushed on stop
+        self.assertEqual([len(batch) for batch in writer.batches], [10, 10, 5])
+        self.assertEqual(sum(writer.batches, []), [(i,) for i in range(25)])
+
+    def test02_batchByTime(self):
+        writer = ListWriter(batch_size=100, flush_period=0.1)
+        writer.write((1,))
+        writer.write((2,))
+        sleep(0.3)
+        self.assertEqual(writer.batches, [[(1,), (2,)]])
+        writer.stop()
+
+    def test03_overflowDropOldest(self):
+        writer = ListWriter(batch_size=100, flush_period=0.1, buffer_size=3)
+        writer.available = False
+        for i in range(5):
+            self.assertTrue(writer.write((i,)))
+        self.assertEqual(writer.dropped, 2)
+        sleep(0.3)  # failed flush returns rows to the buffer
+        writer.available = True
+        writer.stop()
+        self.assertEqual(sum(writer.batches, []), [(2,), (3,), (4,)])
+
+    def test04_overflowDropNewest(self):
+        writer = ListWriter(batch_size=100, flush_period=0.1, buffer_size=2, overflow=inv.OVERFLOW_DROP_NEWEST)
+        writer.available = False
+        self.assertEqual([writer.write((i,)) for i in range(3)], [True, True, False])
+        writer.available = True
+        writer.stop()
+        self.assertEqual(sum(writer.batches, []), [(0,), (1,)])
+
+
+if __name__ == '__main__':
+    unittest.main()
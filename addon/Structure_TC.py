@@ -0,0 +1,113 @@
+import unittest
+import json
+from threading import Thread
+import inventory as inv
+from actors import create_actor
+
+
+class StructureTestCases(unittest.TestCase):
+    def setUp(self):
+        self.first = create_actor({"type": "average", "data": {"src": "ST01", "src_mdl": "T", "box": "S1"}}, 's1')
+        self.second = create_actor({"type": "average", "data": {"src": "s1", "box": "S2"}}, 's2')
+        inv.register_actor(self.first)
+        inv.register_actor(self.second)
+
+    def tearDown(self):
+        inv.wipe_actor(self.second)
+        inv.wipe_actor(self.first)
+
+    def test01_cachedPerRevision(self):
+        revision, export, export_json = inv.get_structure()
+        self.assertEqual(revision, inv.revision)
+        self.assertIs(inv.get_structure()[2], export_json)
+        self.assertEqual(json.loads(export_json), json.loads(json.dumps(export)))
+        self.assertIn('s2', [actor['id'] for actor in export['actors']])
+
+    def test02_onlyTouchedRebuilt(self):
+        inv.get_structure()
+        first_export = self.first.export_cache
+        second_export = self.second.export_cache
+        self.second.config['data']['depth'] = 7
+        self.second.apply_changes()
+        _, export, export_json = inv.get_structure()
+        self.assertIs(self.first.export_cache, first_export)
+        self.assertIsNot(self.second.export_cache, second_export)
+        self.assertIn('"depth": 7', export_json)
+
+    def test03_sharedBuild(self):
+        inv.changed()
+        results = []
+        threads = [Thread(target=lambda: results.append(inv.get_structure())) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len({id(result) for result in results}), 1)
+
+    def test04_postponedSource(self):
+        third = create_actor({"type": "average", "data": {"src": "s4", "box": "S3"}}, 's3')   # source is not loaded
+        inv.register_actor(third)
+        self.assertEqual(third.get_export_cached()[0]['src_key'], inv.SRCKEY_NOSRC)
+        fourth = create_actor({"type": "average", "data": {"src": "s1", "box": "S4"}}, 's4')
+        inv.register_actor(fourth)
+        inv.load_actors_stop()
+        exports = {export['id']: export for export in json.loads(inv.get_structure()[2])['actors']}
+        self.assertEqual(exports['s3']['src_key'], 'ST01/T')    # the cached export is not stale
+        inv.wipe_actor(third)
+        inv.wipe_actor(fourth)
+
+    def test05_editDuringExport(self):
+        inv.changed(self.second)
+        get_export = self.second.get_export
+
+        def get_export_edited():
+            export = get_export()
+            # the Actor is edited by another worker after its old config has been exported
+            self.second.config['data'] = dict(self.second.config['data'], depth=9)
+            self.second.apply_changes()
+            return export
+        self.second.get_export = get_export_edited
+        self.assertNotIn('"depth": 9', inv.get_structure()[2])
+        self.second.get_export = get_export
+        self.assertIsNone(self.second.export_cache)     # the stale export has not been stored
+        self.assertIn('"depth": 9', inv.get_structure()[2])
+
+
+class StructureDeltaTestCases(unittest.TestCase):
+    def test01_delta(self):
+        since = inv.revision
+        actor = create_actor({"type": "average", "data": {"src": "SD01", "src_mdl": "T", "box": "D1"}}, 'd1')
+        inv.register_actor(actor)
+        delta = inv.get_structure_delta(since)
+        self.assertEqual([export['id'] for export in delta['actors']], ['d1'])
+        self.assertEqual(delta['revision'], inv.revision)
+        inv.wipe_actor(actor)
+        delta = inv.get_structure_delta(since)
+        self.assertEqual(delta['actors'], [])
+        self.assertEqual(delta['deleted']['actors'], ['d1'])
+
+    def test02_trimmedChangelog(self):
+        since = inv.revision
+        actor = create_actor({"type": "average", "data": {"src": "SD02", "src_mdl": "T", "box": "D2"}}, 'd2')
+        inv.register_actor(actor)
+        for _ in range(inv.CHANGELOG_SIZE):
+            actor.apply_changes()
+        self.assertIsNone(inv.get_structure_delta(since))  # the full structure is to be exported
+        self.assertIsNotNone(inv.get_structure_delta(inv.revision - 1))
+        inv.wipe_actor(actor)
+
+    def test03_request(self):
+        from manager import request_manage_structure
+        since = inv.revision
+        inv.changed()
+        self.assertEqual(request_manage_structure({"params": {"revision": str(inv.revision)}}),
+                         {'revision': str(inv.revision)})
+        self.assertEqual(request_manage_structure({"params": {"revision": str(since)}})['since'], since)
+        self.assertIn('module-types', request_manage_structure({"params": {"revision": "-1"}}))
+
+    def test04_previousRun(self):
+        self.assertIsNone(inv.get_structure_delta(5))    # revisions of a previous run get the whole structure
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,103 @@
+import unittest
+import json
+from time import sleep
+from threading import Thread
+from urllib.parse import parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import thingspeak
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'   # keep-alive
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length'])).decode('utf-8')
+        self.server.requests.append((self.path, body, self.client_address[1]))
+        status = self.server.statuses.pop(0) if self.server.statuses else 200
+        answer = b'1'
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(answer)))
+        self.end_headers()
+        self.wfile.write(answer)
+        self.close_connection = self.server.drop_idle    # idle connection is closed without notice
+
+    def log_message(self, *args):
+        pass
+
+
+class ThingSpeakTestCases(unittest.TestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+        self.server.requests = []
+        self.server.statuses = []
+        self.server.drop_idle = False
+        Thread(target=self.server.serve_forever, daemon=True).start()
+        self.uploader = thingspeak.Uploader('127.0.0.1:%d' % self.server.server_port, 1, 0.2)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test01_bulkUpdate(self):
+        for value in range(5):
+            self.uploader.put('KEY', {'field1': value}, '123')
+        sleep(0.1)
+        for value in range(5, 8):
+            self.uploader.put('KEY', {'field1': value}, '123')
+        sleep(0.5)
+        self.assertEqual(len(self.server.requests), 2)     # the first sample opens a period
+        path, body, _ = self.server.requests[-1]
+        self.assertEqual(path, '/channels/123/bulk_update.json')
+        body = json.loads(body)
+        self.assertEqual(body['write_api_key'], 'KEY')
+        self.assertEqual([update['field1'] for update in body['updates']], [5, 6, 7])
+        self.assertIn('created_at', body['updates'][0])
+        self.assertEqual(len({port for _, _, port in self.server.requests}), 1)    # connection is reused
+
+    def test02_coalesceUpdate(self):
+        self.uploader.put('KEY', {'field1': 1})
+        sleep(0.1)
+        self.uploader.put('KEY', {'field1': 2, 'field2': 5})
+        self.uploader.put('KEY', {'field1': 3})
+        sleep(0.5)
+        path, body, _ = self.server.requests[-1]
+        self.assertEqual(path, '/update')
+        self.assertEqual(parse_qs(body), {'key': ['KEY'], 'field1': ['3'], 'field2': ['5']})
+
+    def test03_retry(self):
+        self.server.statuses = [500]
+        self.uploader.put('KEY', {'field1': 1}, '123')
+        sleep(0.1)
+        self.assertEqual(self.uploader.failed, 1)
+        sleep(0.6)   # backoff: 2 periods
+        self.assertEqual(self.uploader.uploaded, 1)
+        self.assertEqual(len(self.server.requests), 2)
+        self.assertEqual(self.server.requests[0][1], self.server.requests[1][1])   # the same samples
+
+    def test04_staleConnection(self):
+        self.server.drop_idle = True
+        self.uploader.put('KEY', {'field1': 1}, '123')
+        sleep(0.1)
+        self.uploader.put('KEY', {'field1': 2}, '123')
+        sleep(0.3)
+        self.assertEqual(self.uploader.uploaded, 2)
+        self.assertEqual(self.uploader.failed, 0)   # the request is repeated by a new connection
+        self.assertEqual(len({port for _, _, port in self.server.requests}), 2)
+
+    def test05_channels(self):
+        self.uploader.put('KEY', {'field1': 1}, '123')
+        self.uploader.put('KEY', {'field1': 2}, '456')
+        sleep(0.1)
+        self.assertEqual(sorted(path for path, _, _ in self.server.requests),
+                         ['/channels/123/bulk_update.json', '/channels/456/bulk_update.json'])
+
+    def test06_stop(self):
+        self.uploader.put('KEY', {'field1': 1}, '123')
+        sleep(0.1)
+        self.uploader.put('KEY', {'field1': 2}, '123')
+        self.uploader.stop()    # does not wait for the end of the period
+        self.assertEqual(len(self.server.requests), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Compact Agent messages parsing: the former way - conversion to JSON string by str.replace chain
+and json.loads vs. one pass parser (bus.parse_compact) used by bus.parse_message.
+Run from the project directory: python3 addon/parser_benchmark.py
+"""
+
+import os
+import sys
+import json
+from timeit import repeat
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import bus
+
+MESSAGES = {
+    'data': '{t:21.5,h:40}',
+    'hello': '{id:I23456,modules:[{mal:TEMP,type:dht,prd:60},{mal:IR,type:ir},{mal:RLY,type:relay}]}',
+    'config': '{%s}' % ','.join('m%d:[{mal:M%d,type:gpio,pin:%d}]' % (i, i, i) for i in range(40)),
+}
+NUMBER = 20000
+
+
+def prepare_module_message(message: str) -> str:
+    """ Message in the compact Agent format -> JSON string (the former way). """
+    message = message.replace('{', '{"')
+    message = message.replace('}', '"}')
+    message = message.replace(':', '":"')
+    message = message.replace(',', '","')
+    message = message.replace('"[', '[')
+    message = message.replace(']"', ']')
+    return message.replace('}","{', '},{')
+
+
+def former(message):
+    try:
+        return json.loads(prepare_module_message(message))
+    except ValueError:
+        return message
+
+
+if __name__ == '__main__':
+    print('%-8s %6s %12s %12s' % ('message', 'bytes', 'former, us', 'one pass, us'))
+    for name, message in MESSAGES.items():
+        assert former(message) == bus.parse_message(message)
+        results = [min(repeat(lambda: parse(message), number=NUMBER, repeat=5)) / NUMBER * 1e6
+                   for parse in (former, bus.parse_message)]
+        print('%-8s %6d %12.2f %12.2f' % ((name, len(message)) + tuple(results)))
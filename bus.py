@@ -2,24 +2,187 @@
 # -*- coding: utf-8 -*-
 
 import paho.mqtt.client as mqtt
+import re
 import json
-from threading import Thread
+import asyncio
+from threading import Lock
+from dispatcher import Dispatcher
+import runtime
 import log
 
+DISPATCH_WORKERS = 8        # workers processing messages came from the bus
+DISPATCH_QUEUE_SIZE = 256   # messages waiting for a worker (per worker), the rest is dropped
+
+ROUTE_CACHE_SIZE = 4096     # topics which routes are remembered
+SILENT_TOPICS = ('/manager', '/manager/#')   # messages which are not logged (North talk)
+COALESCE_WINDOW = 0.2       # seconds a message to a coalescing topic waits for a newer one replacing it
+OUTBOUND_POLICIES = {       # delivery of messages sent to topics matching a pattern: (window, qos, retain)
+    '/signal/+/+': (COALESCE_WINDOW, 0, False),     # Actuators could not keep up with bursts, the last value wins
+}
+
+
+class TopicTrie(object):
+    """
+    Values bound to topic patterns kept in a prefix trie by topic levels.
+    Patterns could contain MQTT wildcards: + - any single level, # - any rest levels.
+    Results of matching are remembered, so matching of a known topic is a dict lookup.
+    """
+    def __init__(self, cache_size: int=ROUTE_CACHE_SIZE):
+        self.root = {}      # {level: node}, the value bound to a pattern is kept in its last node by None key
+        self.patterns = {}  # value by pattern
+        self.cache = {}     # topic: (value, levels matched by wildcards)
+        self.cache_size = cache_size
+
+    def add(self, pattern: str, value):
+        node = self.root
+        for level in pattern.split('/'):
+            node = node.setdefault(level, {})
+        node[None] = value
+        self.patterns[pattern] = value
+        self.cache = {}
+
+    def remove(self, pattern: str):
+        node = self.root
+        for level in pattern.split('/'):
+            node = node.get(level, {})
+        node.pop(None, None)
+        self.patterns.pop(pattern, None)
+        self.cache = {}
+
+    def match(self, topic: str) -> tuple:
+        """
+        Find the pattern matching the topic: exact levels win over +, + wins over #.
+        :return: (value, [levels matched by wildcards]) or (None, None) if there is no pattern for the topic
+        """
+        try:
+            return self.cache[topic]
+        except KeyError:
+            pass
+        result = self.__match(self.root, topic.split('/'), 0) or (None, None)
+        if len(self.cache) >= self.cache_size:
+            self.cache = {}
+        self.cache[topic] = result
+        return result
+
+    def __match(self, node: dict, levels: list, index: int):
+        if index == len(levels):
+            if None in node:
+                return node[None], []
+            return (node['#'][None], []) if '#' in node and None in node['#'] else None
+        level = levels[index]
+        if level in node:
+            result = self.__match(node[level], levels, index + 1)
+            if result:
+                return result
+        if '+' in node:
+            result = self.__match(node['+'], levels, index + 1)
+            if result:
+                result[1].insert(0, level)
+                return result
+        if '#' in node and None in node['#']:
+            return node['#'][None], ['/'.join(levels[index:])]
+        return None
+
+
+class Route(object):
+    """ Handlers of messages came in topics matching a pattern. """
+    def __init__(self, pattern: str, handler, responder=None, ordered: bool=False):
+        self.pattern = pattern
+        self.handler = handler          # called by a dispatch worker
+        self.responder = responder      # called in the bus thread before dispatching
+        self.ordered = ordered          # messages with the same first wildcard level are handled in order
+
+
+class Outbound(object):
+    """ Delivery policy of messages sent to topics matching a pattern. """
+    def __init__(self, pattern: str, window: float=0, qos: int=0, retain: bool=False):
+        self.pattern = pattern
+        self.window = window    # seconds a message waits for a newer one to the same topic (0 - sent at once)
+        self.qos = qos          # MQTT QoS
+        self.retain = retain    # the broker keeps the last message for new subscribers
+
+
+class Outgoing(object):
+    """ Message to be published (it is replaced by newer messages to the same topic within the window). """
+    def __init__(self, topic: str, message: str, policy: Outbound):
+        self.topic = topic
+        self.message = message
+        self.policy = policy
+        self.coalesced = 0      # older messages replaced by this one
+
+
 __mqtt_broker = None          # MQTT client
 __on_connect_handler = None   # external handler for a connection event
-__on_message_handler = None   # external handler for a message event
+__routes = TopicTrie()        # Route by topic pattern
+__silent_topics = TopicTrie() # topics of messages which are not logged
+__dispatcher = None           # worker pool processing messages
+__outbound = TopicTrie()      # Outbound by topic pattern
+__outbound_default = Outbound('#')
+__outbox = {}                 # Outgoing waiting for the end of its coalescing window by topic
+__outbox_lock = Lock()
+__outbound_stats = {"published": 0, "coalesced": 0}
 
+for __pattern in SILENT_TOPICS:
+    __silent_topics.add(__pattern, True)
 
-def init(server_address, on_connect, on_message):
-    global __mqtt_broker, __on_connect_handler, __on_message_handler
+
+def route(pattern: str, handler, responder=None, ordered: bool=False) -> Route:
+    """
+    Bind handlers to messages came in topics matching the pattern (to be done before init).
+    Handlers are called with levels matched by wildcards and the message parsed: handler(*levels, message).
+    :param pattern: topic pattern, e.g. /data/+/+
+    :param handler: handler for a message, called by a dispatch worker
+    :param responder: handler for a message called right in the bus thread before dispatching,
+    returns True if the message is consumed and should not be dispatched
+    :param ordered: messages of the same first wildcard level (e.g. Node ID) are handled in the order they came
+    """
+    new_route = Route(pattern, handler, responder, ordered)
+    __routes.add(pattern, new_route)
+    return new_route
+
+
+def outbound(pattern: str, window: float=0, qos: int=0, retain: bool=False) -> Outbound:
+    """
+    Set the delivery policy of messages sent to topics matching the pattern.
+    :param pattern: topic pattern, e.g. /signal/+/+
+    :param window: seconds a message waits for a newer one to the same topic replacing it (0 - sent at once)
+    :param qos: MQTT QoS
+    :param retain: the broker keeps the last message for new subscribers
+    """
+    policy = Outbound(pattern, window, qos, retain)
+    __outbound.add(pattern, policy)
+    return policy
+
+
+def remove_outbound(pattern: str):
+    """ Remove the delivery policy of the pattern (messages get the default one). """
+    __outbound.remove(pattern)
+
+
+for __pattern, __policy in OUTBOUND_POLICIES.items():
+    outbound(__pattern, *__policy)
+
+
+def init(server_address, on_connect, workers: int=DISPATCH_WORKERS, queue_size: int=DISPATCH_QUEUE_SIZE):
+    """
+    Connect to the bus. Topics of routes registered are subscribed.
+    :param server_address: MQTT broker address
+    :param on_connect: handler for a connection event
+    :param workers: number of dispatch workers
+    :param queue_size: number of messages waiting for a dispatch worker
+    """
+    global __mqtt_broker, __on_connect_handler, __dispatcher
 
     __on_connect_handler = on_connect
-    __on_message_handler = on_message
+    if not __dispatcher:
+        __dispatcher = Dispatcher(workers, queue_size, 'Bus dispatcher')
 
     tmp_client = mqtt.Client('KHome')
     tmp_client.on_connect = on_connect_mqtt
     tmp_client.on_message = on_message_mqtt
+    if runtime.loop:
+        # the client socket is served by the event loop
+        attach_to_loop(tmp_client, runtime.loop)
     tmp_client.connect(server_address, 1883, 30)
 
     __mqtt_broker = tmp_client
@@ -29,24 +192,78 @@ def listen():
     __mqtt_broker.loop_forever()
 
 
+def attach_to_loop(client: mqtt.Client, loop: asyncio.AbstractEventLoop):
+    """ Make the event loop read/write the client socket instead of the client network thread. """
+    def on_socket_open(_client, _userdata, sock):
+        loop.call_soon_threadsafe(loop.add_reader, sock, client.loop_read)
+
+    def on_socket_close(_client, _userdata, sock):
+        loop.call_soon_threadsafe(loop.remove_reader, sock)
+
+    def on_socket_register_write(_client, _userdata, sock):
+        loop.call_soon_threadsafe(loop.add_writer, sock, client.loop_write)
+
+    def on_socket_unregister_write(_client, _userdata, sock):
+        loop.call_soon_threadsafe(loop.remove_writer, sock)
+
+    client.on_socket_open = on_socket_open
+    client.on_socket_close = on_socket_close
+    client.on_socket_register_write = on_socket_register_write
+    client.on_socket_unregister_write = on_socket_unregister_write
+
+
+async def listen_async(misc_period: float=1):
+    """
+    Serve the bus connection on the running event loop (asyncio mode).
+    Socket reading/writing is triggered by the loop, keep-alive and reconnection are maintained here.
+    """
+    while True:
+        if __mqtt_broker.loop_misc() == mqtt.MQTT_ERR_NO_CONN:
+            try:
+                __mqtt_broker.reconnect()
+            except OSError as err:
+                log.warning('Cannot reconnect to Bus (%s).' % err)
+        await asyncio.sleep(misc_period)
+
+
 def on_connect_mqtt(client, userdata, flags, rc):
-    __mqtt_broker.subscribe('/manager')   # manager input
-    __mqtt_broker.subscribe('/nodes/#')   # nodes talk
-    __mqtt_broker.subscribe('/data/#')    # data from modules
+    for pattern in get_route_patterns():
+        __mqtt_broker.subscribe(pattern)
 
     global __on_connect_handler
     __on_connect_handler()
 
 
+def get_route_patterns() -> list:
+    return sorted(__routes.patterns)
+
+
 def on_message_mqtt(client, userdata, msg: mqtt.MQTTMessage):
+    topic_route, levels = __routes.match(msg.topic)
+    if not topic_route:
+        return
     message = msg.payload.decode('utf-8')
     # Log
-    if '/manager' not in msg.topic:
+    if not __silent_topics.match(msg.topic)[0]:
         log.bus_income(msg.topic, message)
-    # Processing in a separate thread
-    message = prepare_module_message(message)
-    process_message = Thread(target=__on_message_handler, args=(msg.topic, message))
-    process_message.start()
+    try:
+        message = parse_message(message)
+    except MessageFormatError as err:
+        log.warning('Malformed message in [%s]: %s.' % (msg.topic, err))    # it is processed as plain data
+    # Responses are matched here as their requesters could be waiting in dispatch workers
+    if topic_route.responder and topic_route.responder(*levels, message):
+        return
+    # Processing by the worker pool
+    __dispatcher.submit(levels[0] if topic_route.ordered and levels else None,
+                        topic_route.handler, *levels, message)
+
+
+def get_stats() -> dict:
+    """ Get statistics of incoming messages processing and outgoing messages. """
+    stats = __dispatcher.get_stats() if __dispatcher else {}
+    with __outbox_lock:
+        stats['outbound'] = dict(__outbound_stats, waiting=len(__outbox))
+    return stats
 
 
 def send(topic: str, message, to_esp8266=False) -> str:
@@ -57,25 +274,180 @@ def send(topic: str, message, to_esp8266=False) -> str:
     :param to_esp8266: bool - whether this transmission is intended for ESP8266 -> pack the message
     :return: message sent to the bus
     """
+    return post(topic, message, to_esp8266).message
+
+
+def post(topic: str, message, to_esp8266=False) -> Outgoing:
+    """
+    Send a message to the bus according to the policy of the topic (see outbound).
+    A message to a coalescing topic is published at the end of the window unless a newer one replaces it.
+    :return: message to be published - the same object is returned for messages coalesced
+    """
+    to_send = pack_message(message, to_esp8266)
+    policy = __outbound.match(topic)[0] or __outbound_default
+    if not policy.window:
+        outgoing = Outgoing(topic, to_send, policy)
+        publish(outgoing)
+        return outgoing
+    with __outbox_lock:
+        outgoing = __outbox.get(topic)
+        if outgoing:
+            __replace(outgoing, to_send)
+            return outgoing
+        outgoing = __outbox[topic] = Outgoing(topic, to_send, policy)
+    runtime.call_later(policy.window, flush, outgoing)
+    return outgoing
+
+
+def coalesce(outgoing: Outgoing, message, to_esp8266=False) -> bool:
+    """
+    Replace the message waiting for the end of its coalescing window by a newer one.
+    :return: False if the message has been published already
+    """
+    to_send = pack_message(message, to_esp8266)
+    with __outbox_lock:
+        if __outbox.get(outgoing.topic) is not outgoing:
+            return False
+        __replace(outgoing, to_send)
+    return True
+
+
+def __replace(outgoing: Outgoing, message: str):
+    # the last value wins
+    outgoing.message = message
+    outgoing.coalesced += 1
+    __outbound_stats['coalesced'] += 1
+
+
+def pack_message(message, to_esp8266=False) -> str:
     to_send = message if isinstance(message, str) else json.dumps(message)
-    to_send = to_send if not to_esp8266 else to_send.replace('"', '').replace(' ', '')
+    return to_send if not to_esp8266 else to_send.replace('"', '').replace(' ', '')
+
+
+def flush(outgoing: Outgoing):
+    """ Publish the message at the end of its coalescing window. """
+    with __outbox_lock:
+        if __outbox.get(outgoing.topic) is not outgoing:
+            return      # it has been published already
+        del __outbox[outgoing.topic]
+    publish(outgoing)
+
+
+def flush_all():
+    """ Publish all messages waiting for the end of their coalescing windows (e.g. on shutdown). """
+    with __outbox_lock:
+        waiting = list(__outbox.values())
+        __outbox.clear()
+    for outgoing in waiting:
+        publish(outgoing)
+
+
+def publish(outgoing: Outgoing):
     # Log
-    if '/manager' not in topic:
-        log.bus_outcome(topic, to_send)
+    if not __silent_topics.match(outgoing.topic)[0]:
+        log.bus_outcome(outgoing.topic, outgoing.message)
     # Send
+    with __outbox_lock:
+        __outbound_stats['published'] += 1
     if __mqtt_broker:
-        __mqtt_broker.publish(topic, to_send)
-    return to_send
+        __mqtt_broker.publish(outgoing.topic, outgoing.message, outgoing.policy.qos, outgoing.policy.retain)
 
 
-def prepare_module_message(message: str) -> str:
-    if message.find('"') >= 0:
+class MessageFormatError(ValueError):
+    """ Malformed message in the compact Agent format. """
+    def __init__(self, message: str, position: int, expected: str):
+        super().__init__('%s is expected at position %d in %s' % (expected, position, message))
+        self.message = message
+        self.position = position
+        self.expected = expected
+
+
+def parse_message(message: str):
+    """
+    Message -> Object: compact Agent format or JSON -> dict/list, plain data -> str (or number).
+    :raise MessageFormatError: the message in the compact format is malformed
+    """
+    if message[:1] in ('{', '[') and '"' not in message:
+        return parse_compact(message)
+    try:
+        return json.loads(message)
+    except ValueError:
         return message
 
-    message = message.replace('{', '{"')
-    message = message.replace('}', '"}')
-    message = message.replace(':', '":"')
-    message = message.replace(',', '","')
-    message = message.replace('"[', '[')
-    message = message.replace(']"', ']')
-    return message.replace('}","{', '},{')
+
+__split_compact = re.compile(r'([{}\[\]:,])').split
+__EXPECT_VALUE, __EXPECT_KEY, __EXPECT_NEXT, __EXPECT_END = range(4)
+
+
+def parse_compact(message: str):
+    """
+    Parse a message in the compact Agent format (JSON without quotes, all values are strings) by one pass:
+    {a:1,b:[{c:2},{d:}],e:[x,y]} -> {"a": "1", "b": [{"c": "2"}, {"d": ""}], "e": ["x", "y"]}
+    :param message: message starting with '{' or '['
+    :raise MessageFormatError: the message is malformed
+    """
+    parts = __split_compact(message)    # text, delimiter, text, ..., delimiter, text
+    stack = []          # outer containers of the current one
+    container = None    # dict/list being filled
+    key = None          # key of the value expected in the current dict
+    result = None
+    state = __EXPECT_VALUE
+    text = parts[0]
+    position = len(text) - 1
+    for i in range(1, len(parts), 2):
+        delimiter = parts[i]
+        position += len(text) + 1
+        if state == __EXPECT_KEY:
+            if delimiter == ':':
+                key = text
+                state = __EXPECT_VALUE
+                text = parts[i + 1]
+                continue
+            if delimiter != '}' or text or container:   # '{}' is an empty dict
+                raise MessageFormatError(message, position, "':'")
+        elif state == __EXPECT_VALUE:
+            if delimiter == '{' or delimiter == '[':
+                if text:
+                    raise MessageFormatError(message, position, "',' or closing bracket")
+                if delimiter == '{':
+                    new = {}
+                    state = __EXPECT_KEY
+                else:
+                    new = []
+                if container is None:
+                    result = new
+                elif key is None:
+                    container.append(new)
+                else:
+                    container[key] = new
+                    key = None
+                stack.append(container)
+                container = new
+                text = parts[i + 1]
+                continue
+            if delimiter == ':' or container is None:
+                raise MessageFormatError(message, position, 'value')
+            if key is not None:
+                container[key] = text
+                key = None
+            elif text or delimiter != ']' or container:    # '[]' is an empty list
+                container.append(text)
+        elif state == __EXPECT_NEXT:    # a nested container has been closed
+            if text or delimiter == '{' or delimiter == '[' or delimiter == ':':
+                raise MessageFormatError(message, position - len(text), "',' or closing bracket")
+        else:
+            raise MessageFormatError(message, position - len(text), 'the end')
+        # The value is done - the next one or the end of the container
+        if delimiter == ',':
+            state = __EXPECT_KEY if container.__class__ is dict else __EXPECT_VALUE
+        elif (delimiter == '}') != (container.__class__ is dict):
+            raise MessageFormatError(message, position, "'}'" if container.__class__ is dict else "']'")
+        else:
+            container = stack.pop()
+            state = __EXPECT_END if container is None else __EXPECT_NEXT
+        text = parts[i + 1]
+    if state != __EXPECT_END:
+        raise MessageFormatError(message, len(message), 'closing bracket')
+    if text:
+        raise MessageFormatError(message, len(message) - len(text), 'the end')
+    return result
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+""" Dispatch engine processing incoming messages by a fixed pool of workers. """
+
+import queue
+from itertools import count
+from threading import Thread, Lock
+import log
+
+
+class Dispatcher(object):
+    """
+    Fixed-size pool of workers, each of them having its own bounded queue.
+    Calls submitted with the same key are always processed by the same worker so their order is kept.
+    Calls without a key are spread among workers in turn.
+    If the queue of a worker is full a call is dropped (the submitting thread is never blocked).
+    """
+    def __init__(self, workers: int, queue_size: int, name: str='Dispatcher'):
+        self.name = name
+        self.queues = [queue.Queue(queue_size) for _ in range(max(workers, 1))]
+        self.dispatched = 0         # calls accepted by the pool
+        self.dropped = 0            # calls dropped due to queue overflow
+        self.__next = count()       # round robin for calls without a key
+        self.__lock = Lock()        # counters
+        self.__workers = [Thread(target=self.__work, args=(q,), name='%s-%d' % (name, i), daemon=True)
+                          for i, q in enumerate(self.queues)]
+        for worker in self.__workers:
+            worker.start()
+
+    def submit(self, key, target, *args) -> bool:
+        """
+        Put a call to the queue of a worker.
+        :param key: calls with the same key are processed in order (None - no order is required)
+        :param target: callable to be called by the worker
+        :param args: arguments for the target
+        :return: True if the call is accepted, False if it is dropped
+        """
+        if key is None:
+            index = next(self.__next) % len(self.queues)
+        else:
+            index = hash(key) % len(self.queues)
+        try:
+            self.queues[index].put_nowait((target, args))
+        except queue.Full:
+            with self.__lock:
+                self.dropped += 1
+                dropped = self.dropped
+            if dropped == 1 or not dropped % 100:
+                log.warning('%s is overloaded, %d messages have been dropped.' % (self.name, dropped))
+            return False
+        with self.__lock:
+            self.dispatched += 1
+        return True
+
+    def get_stats(self) -> dict:
+        """ Get queue depth and counters of the pool. """
+        depth = [q.qsize() for q in self.queues]
+        return {
+            "workers": len(self.queues),
+            "queued": sum(depth),
+            "queued-max": max(depth),
+            "dispatched": self.dispatched,
+            "dropped": self.dropped}
+
+    def stop(self):
+        """ Process the calls queued already and stop all workers. """
+        for q in self.queues:
+            q.put(None)
+        for worker in self.__workers:
+            worker.join()
+
+    def __work(self, tasks: queue.Queue):
+        while True:
+            task = tasks.get()
+            if task is None:
+                break
+            target, args = task
+            try:
+                target(*args)
+            except Exception as err:
+                # worker should survive whatever happens in a handler
+                log.error('%s: %s failed with %r.' % (self.name, getattr(target, '__name__', target), err))
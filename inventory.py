@@ -3,8 +3,11 @@
 
 import json
 from time import time
-from threading import Lock
-from threading import Timer
+from itertools import count
+from threading import Lock, BoundedSemaphore, Condition, Thread
+from collections import deque
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+import runtime
 import log
 import pymysql
 from pymysql import DatabaseError
@@ -55,6 +58,27 @@ SRCKEY_SYSTEM = '$'
 BOXNAME_MODULE = '@'
 MODULES_ALL = '~'
 TIMEOUT_RESPONSE = {KHOME_AGENT_INTERFACE['negative']: "timeout"}
+BUSY_RESPONSE = {KHOME_AGENT_INTERFACE['negative']: "busy"}
+SESSION_TIMEOUT = 3         # seconds to wait for a response from an Agent
+SESSION_INFLIGHT_MAX = 4    # requests to one Agent waiting for responses at the same time
+STORAGE_POOL_SIZE = 4           # connections to Storage
+STORAGE_CHECKOUT_TIMEOUT = 5    # seconds to wait for a free connection to Storage
+STORAGE_PING_PERIOD = 30        # seconds of connection idleness after which it is checked before use
+STORAGE_BATCH_SIZE = 200        # rows stored by one INSERT (StorageWriter)
+STORAGE_FLUSH_PERIOD = 1        # seconds a row could wait for its batch to be filled (StorageWriter)
+STORAGE_BUFFER_SIZE = 10000     # rows waiting to be stored (StorageWriter)
+OVERFLOW_DROP_OLDEST = 'drop-oldest'    # full buffer policies: drop the oldest row,
+OVERFLOW_DROP_NEWEST = 'drop-newest'    # drop the row being added,
+OVERFLOW_BLOCK = 'block'                # wait for free space (not longer than a flush period) then drop it
+CHAIN_DEPTH_MAX = 32    # Actors in a chain starting from a Module/Generator
+CHANGELOG_SIZE = 1000   # changes of the structure kept for delta exports
+CHANGE_ADD = 'add'
+CHANGE_DEL = 'del'
+CHANGE_EDIT = 'edit'
+DEADBAND = 0        # numeric fields of periodic Modules changed less are not handled (0 - only equal values)
+DEADBANDS = {       # deadband by Module type
+    '4': 0.1,       # DHT Sensor - temperature/humidity jitter
+}
 
 
 # Base classes
@@ -72,6 +96,8 @@ class BaseObject(object):
         super().__init__()
         self.config = self.get_cfg_dict(cfg)
         self.id = ''
+        self.export_cache = None    # (export, JSON) - see get_export_cached()
+        self.export_changes = 0     # counter of changes made by changed() - stamps the export cache
 
     def set_id(self, oid: str):
         self.id = oid
@@ -87,6 +113,19 @@ class BaseObject(object):
     def get_export(self) -> dict:
         return self.get_cfg()
 
+    def get_export_cached(self) -> tuple:
+        """
+        Get the export and its JSON built once until the object is touched by changed().
+        :return: (export, JSON)
+        """
+        cache = self.export_cache
+        if cache is None:
+            stamp = self.export_changes
+            export = self.get_export()
+            cache = (export, json.dumps(export))
+            store_export_cache(self, stamp, cache)
+        return cache
+
     @staticmethod
     def get_cfg_dict(cfg) -> dict:
         """
@@ -169,22 +208,32 @@ class Module(ConfigObject):
         self.box = Box(self, BOXNAME_MODULE)
         # Load/init module name
         if 'name' not in self.config:
-            self.config['name'] = self.id
-            cursor = storage_open()
-            if cursor:
-                try:
-                    if cursor.execute("SELECT name FROM modules WHERE nid=%s AND mal=%s", (self.nid, self.id)):
-                        self.config['name'] = cursor.fetchall()[0][0]
-                except DatabaseError as err:
-                    log.warning("Cannot load Module name for %s %s." % (str(self), str(err)))
-                finally:
-                    storage_close(cursor)
+            self.config['name'] = get_module_name(self.nid, self.id) or self.id
+        self.period = 0
+        self.deadband = DEADBAND
+        self.alive_timer = None     # Periodical Alive Check timer
+        self.load_settings()
+
+    def load_settings(self):
+        """ Init Module period and deadband by its config. """
         # Init Module period
         try:
             self.period = float(self.config['prd'])
         except (KeyError, ValueError):
             # there is no period value or it is incorrect
             self.period = 0
+        # Init Module deadband ('dband' in the config overrides the one of the Module type)
+        try:
+            self.deadband = float(self.config.get('dband', DEADBANDS.get(self.config.get('t'), DEADBAND)))
+        except ValueError:
+            self.deadband = DEADBAND
+        # Periodical Alive Check follows the period
+        if self.alive_timer:
+            if self.period:
+                self.alive_timer.reschedule(self.period + 1)
+            else:
+                self.alive_timer.cancel()
+                self.alive_timer = None
 
     def __str__(self):
         return "[%s]%s" % (self.nid, self.id)
@@ -208,22 +257,46 @@ class Module(ConfigObject):
     def is_actuator(self):
         return int(self.config['t']) > 50
 
-    def send_signal(self, signal, context_request: dict = None):
+    def send_signal(self, signal):
         return nodes[self.nid].session.start(
-            bus.send(
-                '/signal/%s/%s' % (self.nid, self.id),
-                signal,
-                True),
-            context_request)
+            '/signal/%s/%s' % (self.nid, self.id),
+            signal,
+            '/data/%s/%s' % (self.nid, self.id))
 
     def handle_data(self, data):
-        # Start Periodical Alive Check timer if period is defined
+        # Push the Periodical Alive Check deadline if period is defined
         if self.period:
-            Timer(self.period + 1, self.periodical_alive_check).start()     # 1 sec is an error
-        # Data processing
+            if self.alive_timer:
+                self.alive_timer.reschedule(self.period + 1)    # 1 sec is an error
+            else:
+                self.alive_timer = runtime.call_later(self.period + 1, self.periodical_alive_check)
+        # Data processing (periodic readings are skipped if they have not changed)
+        if self.period and not self.is_changed(data):
+            return
         self.box.value = data
         handle_value(self.src_key, data)
 
+    def is_changed(self, data) -> bool:
+        """
+        Compare data with the value handled before: numeric fields are changed if they differ by the deadband at least.
+        :param data: data came from the Module (dict of fields or a single value)
+        """
+        value = self.box.value
+        if isinstance(data, dict) and isinstance(value, dict):
+            if data.keys() != value.keys():
+                return True
+            return any(self.is_field_changed(value[field], data[field]) for field in data)
+        return self.is_field_changed(value, data)
+
+    def is_field_changed(self, value, data) -> bool:
+        if data == value:
+            return False
+        # Agents send numbers as strings
+        try:
+            return abs(float(data) - float(value)) >= self.deadband
+        except (TypeError, ValueError):
+            return True
+
     def periodical_alive_check(self):
         node = nodes[self.nid]
         if time() - node.last_time_alive > self.period:
@@ -231,7 +304,8 @@ class Module(ConfigObject):
 
     def apply_changes(self):
         """ Method which is to be triggered after the Module is updated. """
-        changed()
+        self.load_settings()
+        changed(self)
 
 
 class Node(ConfigObject):
@@ -249,6 +323,7 @@ class Node(ConfigObject):
         self.modules = {}                           # Modules installed on the Node
         self.session = NodeSession(self)            # session of interconnection with the Node
         self.is_alive = False                       # Node alive flag
+        self.reconciled = False                     # Modules are confirmed by the Agent (see reconcile_modules)
         self.last_time_alive = time()               # LTA - Last Time Alive
 
     def __str__(self):
@@ -274,6 +349,9 @@ class Node(ConfigObject):
 
     def del_module(self, mal: str) -> bool:
         if mal in self.modules:
+            # stop Module timers
+            if self.modules[mal].alive_timer:
+                self.modules[mal].alive_timer.cancel()
             # remove from Node inventory
             del self.modules[mal]
             return True
@@ -310,13 +388,11 @@ class Node(ConfigObject):
             alias_result = '???'    # TODO: finish this idea
         return {alias: alias_result}
 
-    def send_config(self, config, context_request: dict=None):
+    def send_config(self, config):
         return self.session.start(
-            bus.send(
-                '/config/%s' % self.id,
-                config,
-                True),
-            context_request)
+            '/config/%s' % self.id,
+            config,
+            '/nodes/%s' % self.id)
 
 
 class Bridge(ConfigObject):
@@ -332,70 +408,137 @@ class Box(object):
     def __init__(self, owner, name):
         self.owner = owner
         self.name = name
-        self.value = ''
+        self.key = None         # key the Box is registered with (None - it is not registered)
+        self.time = 0           # time the value was set at
+        self.__value = ''
+
+    @property
+    def value(self):
+        return self.__value
+
+    @value.setter
+    def value(self, value):
+        """ Set the value and keep the snapshot of registered Box values up to date. """
+        global box_values_version
+        self.__value = value
+        self.time = time()
+        key = self.key
+        if key is not None:
+            try:
+                box_values[key][self.name] = value
+            except KeyError:
+                pass    # the Box is being unregistered
+        box_values_version = next(box_values_changes)
+
+
+class NodeRequest(object):
+    """ Request sent to an Agent which is waiting for a response. """
+    def __init__(self, response_topic: str):
+        self.message = None                     # message sent to the Agent
+        self.outgoing = None                    # bus.Outgoing - requests coalesced by the bus share it
+        self.response_topic = response_topic    # topic the response is expected on
+        self.future = Future()                  # response
+        self.timeout_timer = None
 
 
 class NodeSession(object):
-    def __init__(self, node: Node):
-        self.node = node            # parent
-        self.active = False
-        self.request = None
-        self.response = None
-        # north
-        self.request_north = None
-        self.id = ''                # Session ID (SID) if there is request from the north
-        # timer and lock
-        self.timeout_timer = None
+    """
+    Connection session with the Agent - requests in flight waiting for responses.
+    A response is matched with the earliest request expecting its topic (messages in other topics are not responses).
+    Requests which messages are coalesced by the bus (see bus.outbound) share one response.
+    """
+    def __init__(self, node: Node, inflight_max: int=SESSION_INFLIGHT_MAX):
+        self.node = node                # parent
+        self.request = None             # the latest message sent to the Agent
+        self.requests = []              # requests in flight (NodeRequest) in order of sending
         self.lock = Lock()
+        self.slots = BoundedSemaphore(inflight_max)
 
-    def start(self, message, request_north: dict):
-        """
-        Start connection session with the Agent
-        :param message: Request (str/dict) sent to the Agent
-        :param request_north: Request from North initially sent to the Manager
-        """
-        self.active = True
-        self.request = message
-        self.response = None
-        # north
-        self.request_north = request_north
-        self.id = self.request_north['session'] if request_north else ''
-        # timer for timeout
-        self.timeout_timer = Timer(3, self.timeout)
-        self.timeout_timer.start()
-        # lock the process till some result
-        self.lock.acquire()
-        self.lock.acquire()
-        self.lock.release()
-        # result
-        return self.response
-
-    def stop(self, result):
-        """
-        Stop connection session after Agent answer.
-        :return: flag that north session is open.
-        """
-        self.active = False
-        self.response = result
-        # north
-        self.request_north = None
-        self.id = ''
-        # timer
-        if self.timeout_timer:
-            self.timeout_timer.cancel()
-            self.timeout_timer = None
-        # unfreeze waiting process (if there is frozen one)
+    @property
+    def active(self) -> bool:
+        return bool(self.requests)
+
+    def start(self, topic: str, message, response_topic: str=''):
+        """
+        Send a request to the Agent and wait for the response.
+        It blocks the caller so it should not be called from the event loop (see send()).
+        :return: response (TIMEOUT_RESPONSE/BUSY_RESPONSE if there is no response)
+        """
         try:
-            self.lock.release()
-        except RuntimeError:
-            pass
+            # the slot and the response are waited for a session timeout each (the timer could be late a bit)
+            return self.send(topic, message, response_topic).result(2 * SESSION_TIMEOUT + 1)
+        except FutureTimeoutError:
+            return TIMEOUT_RESPONSE
+
+    def send(self, topic: str, message, response_topic: str='') -> Future:
+        """
+        Send a request to the Agent.
+        :param topic: topic the request is sent to
+        :param message: request (str/dict)
+        :param response_topic: topic the response is expected on ('' - the topic of the Node)
+        :return: future of the response
+        """
+        response_topic = response_topic or '/nodes/%s' % self.node.id
+        # a request which message has not been published yet takes the new message - one response answers both
+        with self.lock:
+            for pending in self.requests:
+                if pending.outgoing.topic == topic and bus.coalesce(pending.outgoing, message, True):
+                    pending.message = self.request = pending.outgoing.message
+                    return pending.future
+        request = NodeRequest(response_topic)
+        # wait for a free slot if the limit of requests in flight is reached
+        if not self.slots.acquire(timeout=SESSION_TIMEOUT):
+            request.future.set_result(BUSY_RESPONSE)
+            return request.future
+        with self.lock:
+            outgoing = bus.post(topic, message, True)
+            request.message = self.request = outgoing.message
+            for pending in self.requests:
+                if pending.outgoing is outgoing:    # coalesced while waiting for the slot
+                    pending.message = outgoing.message
+                    self.slots.release()
+                    return pending.future
+            request.outgoing = outgoing
+            self.requests.append(request)
+        request.timeout_timer = runtime.call_later(SESSION_TIMEOUT, self.timeout, request)
+        return request.future
+
+    def resolve(self, topic: str, response) -> bool:
+        """
+        Match a message came from the Agent with a request in flight and complete the request.
+        :param topic: topic of the message
+        :param response: message object
+        :return: True if the message is a response to some request
+        """
+        with self.lock:
+            request = self.__match(topic)
+            if request:
+                self.requests.remove(request)
+        if request:
+            self.__complete(request, response)
+        return bool(request)
+
+    def timeout(self, request: NodeRequest):
+        """ Complete the request by timeout. """
+        with self.lock:
+            if request not in self.requests:
+                return
+            self.requests.remove(request)
+        log.warning('Timeout for the message: %s' % request.message)
+        self.node.alive(False)
+        self.__complete(request, TIMEOUT_RESPONSE)
+
+    def __match(self, topic: str):
+        for request in self.requests:
+            if request.response_topic == topic:
+                return request
+        return None
 
-    def timeout(self):
-        """ Stop connection session by timeout. """
-        if self.active:
-            log.warning('Timeout for the message: %s' % self.request)
-            self.node.alive(False)
-            self.stop(TIMEOUT_RESPONSE)
+    def __complete(self, request: NodeRequest, response):
+        if request.timeout_timer:
+            request.timeout_timer.cancel()
+        self.slots.release()
+        request.future.set_result(response)
 
 
 class ModuleError(Exception):
@@ -404,7 +547,7 @@ class ModuleError(Exception):
         self.mal = mal
 
     def __str__(self):
-        return "There is no %s module in inventory" % str(self)
+        return "There is no %s module in inventory" % Module.form_src_key(self.nid, self.mal)
 
 
 class NodeError(Exception):
@@ -412,13 +555,39 @@ class NodeError(Exception):
         self.nid = nid
 
     def __str__(self):
-        return "There is no %s node in inventory" % str(self)
+        return "There is no %s node in inventory" % self.nid
+
+
+class ActorError(Exception):
+    def __init__(self, aid, reason):
+        self.aid = aid
+        self.reason = reason
+
+    def __str__(self):
+        return "Actor %s is rejected: %s" % (self.aid, self.reason)
 
 
 # Actors
 
 class Actor(DBObject):
     """ Units processing data came from Agents. """
+    types = {}  # Actor classes by type - lower-cased class name (subclasses are registered when they are defined)
+
+    def __init_subclass__(cls, abstract: bool=False, **kwargs):
+        """
+        :param abstract: the class is a base of Actor types (it is not registered as a type)
+        """
+        super().__init_subclass__(**kwargs)
+        if abstract:
+            return
+        actor_type = cls.__name__.lower()
+        if actor_type in Actor.types:
+            # a plugin could not replace a type defined before
+            log.warning('Actor type %s of %s is already defined by %s.' %
+                        (actor_type, cls.__module__, Actor.types[actor_type].__module__))
+            return
+        Actor.types[actor_type] = cls
+
     def __new__(cls, cfg, aid):
         try:
             return super().__new__(cls, cfg, aid)
@@ -459,7 +628,7 @@ class Actor(DBObject):
                 else:
                     cursor.execute("INSERT INTO actors (config) VALUES (%s)", json.dumps(self.get_cfg()))
                     self.set_id(str(cursor.lastrowid))
-                storage_save()
+                storage_save(cursor)
             except DatabaseError as err:
                 log.warning("Cannot store %s in Storage %s." % (str(self), str(err)))
             finally:
@@ -475,7 +644,7 @@ class Actor(DBObject):
             if cursor:
                 try:
                     cursor.execute("DELETE FROM actors WHERE id=%s", self.id)
-                    storage_save()
+                    storage_save(cursor)
                 except DatabaseError as err:
                     log.warning("Cannot delete %s from Storage %s." % (str(self), str(err)))
                 finally:
@@ -484,6 +653,7 @@ class Actor(DBObject):
     def set_active(self, status: bool):
         self.active = status
         self.config['active'] = status
+        changed(self)   # execution plans of Handlers are to be recompiled
 
     def process_signal(self, sig):
         """
@@ -494,10 +664,10 @@ class Actor(DBObject):
 
     def apply_changes(self):
         """ Method which is to be triggered after the Actor is updated. """
-        changed()
+        changed(self)
 
 
-class Handler(Actor):
+class Handler(Actor, abstract=True):
     """
     Actor data source is a Module or another Actor.
     """
@@ -526,7 +696,7 @@ class Handler(Actor):
             self.config['data']['src_mdl'] if 'src_mdl' in self.config['data'] else '')
 
 
-class Generator(Actor):
+class Generator(Actor, abstract=True):
     """
     Actor data source is a system.
     """
@@ -537,35 +707,239 @@ class Generator(Actor):
 
 # Storage
 
-__storage_client = None
-__storage_lock = Lock()
+class StoragePool(object):
+    """
+    Pool of Storage connections used by concurrent handlers.
+    A connection is checked (and reconnected) before it is handed out if it has been idle for a while.
+    """
+    def __init__(self, connect, size: int=STORAGE_POOL_SIZE, timeout: float=STORAGE_CHECKOUT_TIMEOUT,
+                 ping_period: float=STORAGE_PING_PERIOD):
+        """
+        :param connect: function creating a new connection
+        :param size: connections maximum
+        :param timeout: seconds to wait for a free connection
+        :param ping_period: seconds of idleness after which a connection is checked
+        """
+        self.connect = connect
+        self.timeout = timeout
+        self.ping_period = ping_period
+        self.idle = []                          # idle connections - [connection, time of last use]
+        self.lock = Lock()
+        self.slots = BoundedSemaphore(size)
+
+    def checkout(self):
+        """
+        Get a connection from the pool.
+        :return: connection or None if there is no free connection in time or Storage is not available
+        """
+        if not self.slots.acquire(timeout=self.timeout):
+            log.warning('There is no free connection to Storage.')
+            return None
+        with self.lock:
+            connection, last_use = self.idle.pop() if self.idle else (None, 0)
+        try:
+            if not connection:
+                connection = self.connect()
+            elif time() - last_use > self.ping_period:
+                connection.ping(reconnect=True)     # health check
+            return connection
+        except DatabaseError as err:
+            log.warning('Cannot connect to Storage %s.' % err)
+            self.slots.release()
+            return None
+
+    def checkin(self, connection):
+        """
+        Return the connection to the pool (broken connection is dropped).
+        Work not committed is rolled back - the next borrower starts a new transaction.
+        """
+        try:
+            if connection.open:
+                connection.rollback()
+                with self.lock:
+                    self.idle.append([connection, time()])
+        except DatabaseError:
+            connection.close()
+        finally:
+            self.slots.release()
+
+    def close(self):
+        with self.lock:
+            for connection, _ in self.idle:
+                connection.close()
+            self.idle = []
+
+
+__storage_pool = None               # type: StoragePool
+__module_names = None               # Module names stored by (nid, mal) - see load_module_names()
+__storage_writers = {}              # StorageWriter by its statement
+__storage_lock_writers = Lock()
 
 
-def storage_init(server_address: str):
-    global __storage_client
-    if __storage_client:
-        __storage_client.close()
-    __storage_client = pymysql.connect(host=server_address, user='khome', passwd='khome', db='khome')
+def storage_init(server_address: str, pool_size: int=STORAGE_POOL_SIZE):
+    global __storage_pool
+    if __storage_pool:
+        __storage_pool.close()
+
+    def connect():
+        return pymysql.connect(host=server_address, user='khome', passwd='khome', db='khome')
+
+    pool = StoragePool(connect, pool_size)
+    pool.idle.append([connect(), time()])   # Storage should be available on start
+    __storage_pool = pool
+    load_module_names()
 
 
 def storage_open() -> pymysql.cursors.Cursor:
-    if __storage_client:
-        cursor = __storage_client.cursor()
-        if cursor:
-            __storage_lock.acquire()
-            return cursor
+    if __storage_pool:
+        connection = __storage_pool.checkout()
+        if connection:
+            return connection.cursor()
     return None
 
 
 def storage_close(cursor: pymysql.cursors.Cursor):
     if cursor:
+        connection = cursor.connection
         cursor.close()
-        __storage_lock.release()
+        if __storage_pool:
+            __storage_pool.checkin(connection)
+        else:
+            connection.close()  # Storage has been shut down
+
+
+def storage_save(cursor: pymysql.cursors.Cursor):
+    """ Commit the transaction of the cursor connection. """
+    if cursor:
+        cursor.connection.commit()
 
 
-def storage_save():
-    if __storage_client:
-        __storage_client.commit()
+class StorageWriter(object):
+    """
+    Background writer storing rows to Storage by batches - multi-row INSERT and one commit per batch.
+    A batch is flushed when it is full or when the flush period is over.
+    Rows are buffered till they are stored, the buffer is bounded - see OVERFLOW_* policies.
+    """
+    def __init__(self, statement: str, batch_size: int=STORAGE_BATCH_SIZE, flush_period: float=STORAGE_FLUSH_PERIOD,
+                 buffer_size: int=STORAGE_BUFFER_SIZE, overflow: str=OVERFLOW_DROP_OLDEST):
+        """
+        :param statement: INSERT statement for one row, e.g. "INSERT INTO t (a, b) VALUES (%s, %s)"
+        :param batch_size: rows stored by one INSERT
+        :param flush_period: seconds a row could wait for a batch to be filled
+        :param buffer_size: rows waiting to be stored
+        :param overflow: policy applied when the buffer is full
+        """
+        self.statement = statement
+        self.batch_size = batch_size
+        self.flush_period = flush_period
+        self.buffer_size = buffer_size
+        self.overflow = overflow
+        self.rows = deque()             # rows waiting to be stored
+        self.stored = 0                 # rows stored
+        self.dropped = 0                # rows dropped due to buffer overflow or Storage failure
+        self.__condition = Condition()
+        self.__thread = None
+        self.__stopping = False
+
+    def write(self, row: tuple) -> bool:
+        """
+        Put the row to the buffer.
+        :return: False if the row has been dropped
+        """
+        with self.__condition:
+            if len(self.rows) >= self.buffer_size:
+                if self.overflow == OVERFLOW_BLOCK:
+                    self.__condition.wait_for(lambda: len(self.rows) < self.buffer_size, self.flush_period)
+                if len(self.rows) >= self.buffer_size:
+                    self.dropped += 1
+                    if self.overflow != OVERFLOW_DROP_OLDEST:
+                        return False
+                    self.rows.popleft()
+            self.rows.append(row)
+            if not self.__thread:
+                self.__thread = Thread(target=self.__run, name='Storage writer', daemon=True)
+                self.__thread.start()
+            if len(self.rows) >= self.batch_size:
+                self.__condition.notify_all()
+        return True
+
+    def stop(self):
+        """ Store all buffered rows and stop the writer. """
+        with self.__condition:
+            self.__stopping = True
+            self.__condition.notify_all()
+            thread = self.__thread
+        if thread:
+            thread.join()
+
+    def store(self, rows: list) -> bool:
+        """
+        Store rows in Storage.
+        :return: False if Storage is not available (rows should be stored later)
+        """
+        cursor = storage_open()
+        if not cursor:
+            return False
+        try:
+            cursor.executemany(self.statement, rows)   # pymysql makes one multi-row INSERT
+            storage_save(cursor)
+            with self.__condition:
+                self.stored += len(rows)
+        except DatabaseError as err:
+            with self.__condition:
+                self.dropped += len(rows)
+            log.warning('Cannot store %d rows in Storage %s.' % (len(rows), err))
+        finally:
+            storage_close(cursor)
+        return True
+
+    def __run(self):
+        is_failed = False
+        while True:
+            with self.__condition:
+                if is_failed and not self.__stopping:
+                    # Storage is not available - wait a flush period before the next try
+                    self.__condition.wait(self.flush_period)
+                else:
+                    # wait for a full batch or the end of the flush period
+                    self.__condition.wait_for(lambda: self.__stopping or len(self.rows) >= self.batch_size,
+                                              self.flush_period)
+                batch = [self.rows.popleft() for _ in range(min(self.batch_size, len(self.rows)))]
+                stopping = self.__stopping
+                self.__condition.notify_all()
+            is_failed = bool(batch) and not self.store(batch)
+            if is_failed:
+                # Storage is not available - return the batch to the buffer (overflow drops the oldest rows)
+                with self.__condition:
+                    self.rows.extendleft(reversed(batch))
+                    while len(self.rows) > self.buffer_size:
+                        self.rows.popleft()
+                        self.dropped += 1
+                if stopping:
+                    log.warning('%d rows have not been stored in Storage.' % len(self.rows))
+                    break
+            if stopping and not self.rows:
+                break
+        with self.__condition:
+            self.__thread = None
+
+
+def storage_writer(statement: str) -> StorageWriter:
+    """ Get the writer shared by all who store rows with the statement. """
+    with __storage_lock_writers:
+        if statement not in __storage_writers:
+            __storage_writers[statement] = StorageWriter(statement)
+        return __storage_writers[statement]
+
+
+def storage_shutdown():
+    """ Store all buffered rows and close Storage. """
+    global __storage_pool
+    for writer in list(__storage_writers.values()):
+        writer.stop()
+    if __storage_pool:
+        __storage_pool.close()
+        __storage_pool = None
 
 
 def load_actors_start() -> dict:
@@ -593,24 +967,65 @@ def load_actors_stop():
                 if actor.set_src_key() == SRCKEY_NOSRC:
                     log.warning('Actor %s is to be deleted as no source was found for it.' % actor)
                     aids_to_remove.append(aid)
-                elif actor.box:
-                    # Re-register Actor Box using new source key
-                    __register_box(actor.box)
+                else:
+                    if actor.box:
+                        # Re-register Actor Box using new source key
+                        __register_box(actor.box)
+                    changed(actor)  # exported source key is changed
         # Wipe source-less Actors and Boxes
         for aid in aids_to_remove:
             wipe_actor(actors[aid])
         del boxes[SRCKEY_NOSRC]
+        box_values.pop(SRCKEY_NOSRC, None)
     except KeyError:
         pass    # there are no postponed Boxes
 
 
+def load_module_names() -> bool:
+    """
+    Load names of all Modules stored into the index used instead of querying Storage for every Module.
+    :return: False if the names could not be loaded (every Module name is queried then)
+    """
+    global __module_names
+    cursor = storage_open()
+    if cursor:
+        try:
+            cursor.execute("SELECT nid, mal, name FROM modules")
+            __module_names = {(nid, mal): name for nid, mal, name in cursor}
+            return True
+        except DatabaseError as err:
+            log.warning("Cannot load Module names from Storage %s." % str(err))
+        finally:
+            storage_close(cursor)
+    return False
+
+
+def get_module_name(nid: str, mal: str) -> str:
+    """ Get the name of the Module stored ('' if there is no name). """
+    if __module_names is not None:
+        return __module_names.get((nid, mal), '')
+    # Query Storage if the names have not been loaded
+    cursor = storage_open()
+    if cursor:
+        try:
+            if cursor.execute("SELECT name FROM modules WHERE nid=%s AND mal=%s", (nid, mal)):
+                return cursor.fetchall()[0][0]
+        except DatabaseError as err:
+            log.warning("Cannot load Module name for %s %s." % (Module.form_src_key(nid, mal), str(err)))
+        finally:
+            storage_close(cursor)
+    return ''
+
+
 def store_module(module: Module) -> bool:
     cursor = storage_open()
     if cursor:
         try:
             cursor.execute("INSERT INTO modules (nid, mal, name) VALUES (%s, %s, %s) ON DUPLICATE KEY UPDATE name=%s",
                            (module.nid, module.id, module.config['name'], module.config['name']))
-            storage_save()
+            storage_save(cursor)
+            if __module_names is not None:
+                __module_names[(module.nid, module.id)] = module.config['name']
             return True
         except DatabaseError as err:
             log.warning("Cannot store Module in Storage %s." % str(err))
@@ -624,7 +1039,9 @@ def forget_module(module: Module):
     if cursor:
         try:
             cursor.execute("DELETE FROM modules WHERE nid=%s AND mal=%s", (module.nid, module.id))
-            storage_save()
+            storage_save(cursor)
+            if __module_names is not None:
+                __module_names.pop((module.nid, module.id), None)
         except DatabaseError as err:
             log.warning("Cannot remove Module from Storage %s." % str(err))
         finally:
@@ -633,18 +1050,143 @@ def forget_module(module: Module):
 
 # Inventory
 
-revision = 0    # version of KHome inventory
+revision = int(time() * 1000)   # version of KHome inventory (from the start time so runs do not share revisions)
 nodes = {}      # Nodes registered in KHome
 actors = {}     # Actors processing data from Modules
 handlers = {}   # Actors processing data from a related Module/Actor
 boxes = {}      # Objects storing data of Modules/Actors
+box_values = {}     # snapshot of Box values by Box key and name
+box_values_changes = count()
+box_values_version = next(box_values_changes)   # changed whenever a Box value is set
+
+__plans = {}            # execution plans of Handlers by source key (compiled for __plans_revision)
+__plans_revision = -1
+__plans_lock = Lock()
+
+__changelog = deque(maxlen=CHANGELOG_SIZE)   # (revision, CHANGE_*, 'nodes'/'actors', id) - see changed()
+__changelog_start = revision    # the changelog keeps all changes made after this revision
+__changelog_lock = Lock()
+
+__box_values_json = None, ''   # JSON of the Box values snapshot (box_values_version, JSON)
+
+__structure = None      # export of the whole structure (revision, export, JSON) - see get_structure()
+__structure_lock = Lock()
+
+
+def changed(*touched, change: str=CHANGE_EDIT) -> int:
+    """
+    Mark that some changes in inventory have been made.
+    :param touched: Nodes, Modules and Actors changed (their exports are to be rebuilt)
+    :param change: CHANGE_ADD, CHANGE_DEL or CHANGE_EDIT - what has been done with the objects touched
+    """
+    global revision, __changelog_start
+    with __changelog_lock:
+        revision += 1
+        for touched_object in touched:
+            touched_object.export_cache = None
+            touched_object.export_changes += 1
+            if isinstance(touched_object, Module):
+                # Modules are exported within their Node
+                touched_object = nodes.get(touched_object.nid)
+                if not touched_object:
+                    continue
+                touched_object.export_cache = None
+                touched_object.export_changes += 1
+                entry = (revision, CHANGE_EDIT, 'nodes', touched_object.id)
+            else:
+                entry = (revision, change, 'nodes' if isinstance(touched_object, Node) else 'actors',
+                         touched_object.id)
+            if len(__changelog) == __changelog.maxlen:
+                __changelog_start = __changelog[0][0]   # changes of this revision are not complete any more
+            __changelog.append(entry)
+        return revision
+
+
+def store_export_cache(touched_object: BaseObject, stamp: int, cache: tuple) -> bool:
+    """
+    Store the export built for the object unless it has been changed during the build.
+    :param touched_object: Node, Module or Actor exported
+    :param stamp: export_changes of the object read before the export was built
+    :param cache: (export, JSON) built
+    :return: True if the export has been stored
+    """
+    with __changelog_lock:
+        if touched_object.export_changes != stamp:
+            return False
+        touched_object.export_cache = cache
+        return True
+
+
+def restart_revision(start: int) -> int:
+    """
+    Continue the revision numbering from the revision (e.g. of a snapshot) if it is greater.
+    Changes made before are forgotten - requesters having older revisions get the whole structure.
+    """
+    global revision, __changelog_start
+    with __changelog_lock:
+        revision = max(revision, start)
+        __changelog.clear()
+        __changelog_start = revision
+        return revision
 
 
-def changed() -> int:
-    """ Mark that some changes in inventory have been made. """
-    global revision
-    revision += 1
-    return revision
+def get_structure_delta(since: int) -> dict:
+    """
+    Get the export of the structure changes made after the revision:
+    Nodes and Actors added or changed are exported, ids of ones deleted are listed.
+    :param since: revision the requester has
+    :return: {'revision', 'since', 'nodes', 'actors', 'deleted': {'nodes', 'actors'}}
+    or None if the changes are not known (the changelog has been trimmed)
+    """
+    with __changelog_lock:
+        if since < __changelog_start or since > revision:
+            return None
+        delta_revision = revision
+        changes = {'nodes': {}, 'actors': {}}
+        for entry_revision, change, kind, oid in __changelog:
+            if entry_revision > since:
+                changes[kind][oid] = change     # the latest change of the object
+    delta = {'revision': delta_revision, 'since': since, 'nodes': [], 'actors': [],
+             'deleted': {'nodes': [], 'actors': []}}
+    for kind, registry in (('nodes', nodes), ('actors', actors)):
+        for oid, change in changes[kind].items():
+            changed_object = registry.get(oid)
+            if change == CHANGE_DEL or changed_object is None:
+                delta['deleted'][kind].append(oid)
+            else:
+                delta[kind].append(changed_object.get_export_cached()[0])
+    return delta
+
+
+def get_structure() -> tuple:
+    """
+    Get the export of the whole structure for the current revision.
+    It is built once per revision (concurrent requesters wait for the build and share it),
+    only the objects touched since the previous build are exported again.
+    :return: (revision, export, JSON)
+    """
+    global __structure
+    structure = __structure
+    if structure and structure[0] == revision:
+        return structure
+    with __structure_lock:
+        if __structure and __structure[0] == revision:
+            return __structure
+        built_revision = revision
+        node_exports = [node.get_export_cached() for node in list(nodes.values())]
+        actor_exports = [actor.get_export_cached() for actor in list(actors.values())]
+        export = {
+            'revision': built_revision,
+            'module-types': KHOME_AGENT_INTERFACE['module_types'],
+            'nodes': [node_export for node_export, _ in node_exports],
+            'actors': [actor_export for actor_export, _ in actor_exports]}
+        encoded = '{"revision": %d, "module-types": %s, "nodes": [%s], "actors": [%s]}' % (
+            built_revision,
+            json.dumps(KHOME_AGENT_INTERFACE['module_types']),
+            ', '.join(node_json for _, node_json in node_exports),
+            ', '.join(actor_json for _, actor_json in actor_exports))
+        __structure = built_revision, export, encoded
+        return __structure
 
 
 def register_node(node_cfg):
@@ -659,16 +1201,54 @@ def register_node(node_cfg):
     # Store the new one
     if new_node and new_node.id not in nodes:
         nodes[new_node.id] = new_node
-        changed()
+        changed(new_node, change=CHANGE_ADD)
         return new_node
     else:
         return None
 
 
+def refresh_node(node_cfg) -> Node:
+    """
+    Update the config of the Node which Modules have not been confirmed by its Agent
+    (restored from a snapshot or its handshake has failed) by the one came in Hello message.
+    :return: the Node if it should be reconciled (see reconcile_modules) or None
+    """
+    node = nodes.get(node_cfg.get('id'))
+    if node and not node.reconciled:
+        if node.config != node_cfg:
+            node.config = node_cfg
+            changed(node)
+        return node
+    return None
+
+
+def reconcile_modules(node: Node, module_cfgs: list):
+    """
+    Make Modules of the Node match the Module configs reported by its Agent:
+    new Modules are registered, changed ones are updated, ones which are not reported are wiped.
+    """
+    reported = set()
+    for module_cfg in module_cfgs:
+        module = node.modules.get(module_cfg.get('a'))
+        if not module:
+            module = register_module(node, module_cfg)
+        elif any(module.config.get(tag) != value for tag, value in module_cfg.items()):
+            module.config.update(module_cfg)
+            module.apply_changes()
+        if module:
+            reported.add(module.id)
+    for mal in [mal for mal in node.modules if mal not in reported]:
+        src_key = node.modules[mal].src_key
+        if node.del_module(mal):
+            __wipe_boxes_by_key(src_key)
+            changed(node)
+    node.reconciled = True
+
+
 def register_module(node: Node, module_cfg, added: bool=False) -> Module:
     new_module = node.add_module(module_cfg)
     if new_module:
-        changed()
+        changed(node)
         # add Module Box to Manager Box list
         __register_box(new_module.box)
         # Store Module data in Storage
@@ -681,8 +1261,10 @@ def register_actor(actor: Actor) -> Actor:
     """
     Append the Actor to the Manager registry.
     :rtype: Actor
+    :raise ActorError: the Actor would close a loop of Actors or make a chain too deep
     """
     if actor:
+        check_chain(actor)
         # add Actor to Actors list
         actors[actor.id] = actor
         actor.set_src_key()
@@ -692,10 +1274,73 @@ def register_actor(actor: Actor) -> Actor:
         if actor.box:
             __register_box(actor.box)
         # note that the structure was updated
-        changed()
+        changed(actor, change=CHANGE_ADD)
     return actor
 
 
+def check_chain(actor: Actor, data: dict=None):
+    """
+    Check the chain of Actors the Actor is to be a part of: the Actor sources from the Module/Actor
+    set in config data, Actors chained to the Actor (if it is registered already) follow it.
+    Only the sources of the Actor and the Actors chained to it are walked through.
+    :param actor: Actor to be checked
+    :param data: config data to be set to the Actor (the current one if it is None)
+    :raise ActorError: the chain would loop or be longer than CHAIN_DEPTH_MAX
+    """
+    if not isinstance(actor, Handler):
+        return
+    if data is None:
+        data = actor.config['data']
+    # Actors chained to the Actor
+    depth = 1
+    level = handlers.get(actor.id, [])
+    while level:
+        depth += 1
+        if depth > CHAIN_DEPTH_MAX:
+            raise ActorError(actor.id, "the chain of Actors is longer than %d" % CHAIN_DEPTH_MAX)
+        level = [child for parent in level for child in handlers.get(parent.id, [])]
+    # Sources of the Actor
+    source = None if data.get('src_mdl') else data['src']
+    while source is not None:
+        if source == actor.id:
+            raise ActorError(actor.id, "the chain of Actors loops back to it")
+        depth += 1
+        if depth > CHAIN_DEPTH_MAX:
+            raise ActorError(actor.id, "the chain of Actors is longer than %d" % CHAIN_DEPTH_MAX)
+        parent = actors.get(source)
+        if not isinstance(parent, Handler) or parent.config['data'].get('src_mdl'):
+            break
+        source = parent.config['data']['src']
+
+
+def set_actor_source(actor: Actor, data: dict):
+    """
+    Move the Handler to another source and re-register it with all Actors chained to it.
+    :param actor: Handler to be moved
+    :param data: source config data - src and src_mdl (empty src_mdl means that the source is an Actor)
+    :raise ActorError: the chain of Actors would loop or be too deep
+    """
+    check_chain(actor, dict(actor.config['data'], **data))
+    __wipe_handler(actor)
+    actor.config['data'].update(data)
+    if not actor.config['data'].get('src_mdl', True):
+        del actor.config['data']['src_mdl']
+    # Actors chained to the Actor get a new source key as well
+    chain = [actor]
+    for chained in chain:
+        chain.extend(handlers.get(chained.id, []))
+    for chained in chain:
+        if chained.box:
+            __wipe_box(chained.box)
+    actor.set_src_key()
+    for chained in chain:
+        chained.src_key = actor.src_key
+        if chained.box:
+            __register_box(chained.box)
+    __register_handler(actor)
+    changed(*chain)
+
+
 def __register_box(box: Box):
     """
     Add Box object to the Manager Box list using the key based on nid/mal got from box owner.
@@ -707,6 +1352,8 @@ def __register_box(box: Box):
     except KeyError:
         boxes[key] = {}
         boxes[key][box.name] = box
+    box.key = key
+    box_values.setdefault(key, {})[box.name] = box.value
 
 
 def __register_handler(handler):
@@ -728,7 +1375,7 @@ def wipe_module(node: Node, mal: str) -> bool:
         forget_module(module)
         if node.del_module(mal):
             __wipe_boxes_by_key(module.src_key)
-            changed()
+            changed(node)
             return True
     except KeyError:
         pass
@@ -746,7 +1393,7 @@ def wipe_actor(actor: Actor):
     # del Actor from Storage
     actor.delete_db()
     # note that the structure was updated
-    changed()
+    changed(actor, change=CHANGE_DEL)
 
 
 def __wipe_handler(handler):
@@ -761,6 +1408,8 @@ def __wipe_box(box: Box):
     :param box: Box to be wiped.
     """
     del boxes[box.owner.src_key][box.name]
+    box_values.get(box.owner.src_key, {}).pop(box.name, None)
+    box.key = None
 
 
 def __wipe_boxes_by_key(box_key: str):
@@ -768,14 +1417,99 @@ def __wipe_boxes_by_key(box_key: str):
     Wipe set of Boxes tied to one box key.
     :param box_key: Box key to be wiped with all boxes tied to.
     """
-    del boxes[box_key]
+    for box in boxes.pop(box_key).values():
+        box.key = None
+    box_values.pop(box_key, None)
+
+
+def get_box_values() -> dict:
+    """ Get a copy of the Box values snapshot: {key: {name: value}}. """
+    return {key: dict(values) for key, values in list(box_values.items())}
+
+
+def get_box_values_json() -> str:
+    """ Get JSON of the Box values snapshot, it is encoded again only if some value has been set. """
+    global __box_values_json
+    version = box_values_version
+    cached_version, cached = __box_values_json
+    if cached_version != version:
+        cached = json.dumps(get_box_values())
+        __box_values_json = version, cached
+    return cached
+
+
+def find_boxes(keys: list=None, nid: str='', actor_type: str='', since: float=0) -> list:
+    """
+    Find registered Boxes.
+    :param keys: Box keys (all keys if it is None)
+    :param nid: Node ID - only Boxes fed by Modules of the Node
+    :param actor_type: only Boxes of Actors of the type
+    :param since: only Boxes which values have been set after the time
+    :return: [Box] sorted by key and name
+    """
+    found = []
+    # Boxes are registered by dispatch workers meanwhile - copies are iterated
+    for key in sorted(list(boxes) if keys is None else set(keys) & set(boxes)):
+        if nid and key != nid and not key.startswith(nid + '/'):
+            continue
+        for name, box in sorted(list(boxes.get(key, {}).items()), key=lambda item: item[0]):
+            if actor_type and not (isinstance(box.owner, Actor) and
+                                   box.owner.config['type'].lower() == actor_type.lower()):
+                continue
+            if not since or box.time > since:
+                found.append(box)
+    return found
 
 
 def handle_value(key: str, value):
-    if key in handlers:
-        for actor in handlers[key]:
-            # Process the value by the Handler found (if it is active)
-            if actor.active:
-                actor.process_signal(value)
-                # Process the value/Actor Box value by Handlers referring to this Actor
-                handle_value(actor.id, actor.box.value if actor.box else value)
+    """
+    Process the value by the Handlers of the source key and by the Handlers chained to them.
+    :param key: source key (Module src_key or Actor id)
+    :param value: signal to be processed
+    """
+    plan = get_handler_plan(key)
+    if plan:
+        outputs = [None] * len(plan)
+        for step, (actor, parent) in enumerate(plan):
+            signal = value if parent < 0 else outputs[parent]
+            actor.process_signal(signal)
+            # Handlers referring to this Actor get the Actor Box value
+            outputs[step] = actor.box.value if actor.box else signal
+
+
+def get_handler_plan(key: str) -> tuple:
+    """
+    Get the execution plan of the source key compiled for the current inventory revision.
+    :return: ((Actor, index of the step the Actor gets a signal from or -1 for the source value), ...)
+    """
+    global __plans, __plans_revision
+    plans = __plans
+    if __plans_revision != revision:
+        with __plans_lock:
+            if __plans_revision != revision:
+                __plans = {}
+                __plans_revision = revision
+            plans = __plans
+    try:
+        return plans[key]
+    except KeyError:
+        plan = plans[key] = __compile_handler_plan(key)
+        return plan
+
+
+def __compile_handler_plan(key: str) -> tuple:
+    """
+    Flatten the chain of active Handlers starting from the source key (depth-first, parents go first).
+    Inactive Handlers are skipped with all Handlers chained to them, looped Handlers are included once.
+    """
+    plan = []
+    included = set()
+    pending = [(actor, -1) for actor in reversed(handlers.get(key, ()))]
+    while pending:
+        actor, parent = pending.pop()
+        if not actor.active or actor.id in included:
+            continue
+        included.add(actor.id)
+        plan.append((actor, parent))
+        pending.extend((child, len(plan) - 1) for child in reversed(handlers.get(actor.id, ())))
+    return tuple(plan)
@@ -1,49 +1,169 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-__logfile = ''
-
+"""
+Log of the Manager.
+Records are written by a background thread - the caller only puts a record to the queue
+(the queue is bounded: records are dropped and counted if the writer could not keep up).
+The log file is rotated by size and age: khome.log -> khome.log.1 -> ... -> khome.log.<ROTATE_COUNT>.
+"""
+
+import os
+import atexit
+from time import time, ctime, mktime, strptime
+from queue import Queue, Empty, Full
+from itertools import count
+from threading import Thread, Lock
+
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+
+ROTATE_SIZE = 10 * 1024 * 1024  # bytes - the log file is rotated when it is bigger
+ROTATE_PERIOD = 7 * 24 * 3600   # seconds - the log file is rotated when it has been written longer
+ROTATE_COUNT = 5                # rotated files kept
+BATCH_SIZE = 1000               # records written before the file is flushed
+QUEUE_SIZE = 10000              # records waiting for the writer, the rest is dropped
 
-def init(logfile: str = ''):
-    global __logfile
+__logfile = ''
+__level = DEBUG                 # records with a lower level are skipped
+__bus_sampling = 1              # every N-th bus message is logged (0 - bus messages are not logged)
+__bus_counter = count()
+__records = Queue(QUEUE_SIZE)   # records to be written - (time, message, interchange) or None to stop
+__writer = None
+__writer_lock = Lock()
+__exit_registered = False
+dropped = 0                     # records dropped as the queue was full
+
+
+def init(logfile: str = '', level: int = DEBUG, bus_sampling: int = 1):
+    """
+    :param logfile: file for records (stdout if it is empty)
+    :param level: the lowest level of records to be logged
+    :param bus_sampling: every N-th bus message is logged (0 - bus messages are not logged)
+    """
+    global __logfile, __level, __bus_sampling
+    if logfile != __logfile:
+        stop()  # records queued are written to the previous file, the writer opens the new one
     __logfile = logfile
+    __level = level
+    __bus_sampling = bus_sampling
 
 
 def out(message, interchange: bool = False):
-    # Prepare
-    from time import ctime
-    message = str(ctime()) + ' ' + message
-    # Print
-    if __logfile and not interchange:
-        try:
-            f = open(__logfile, 'a')
-        except FileNotFoundError:
-            f = open(__logfile, 'w')
-        f.write(message + '\n')
-        f.close()
-    else:
-        print(message)
+    global __writer, __exit_registered, dropped
+    if not __writer:
+        with __writer_lock:
+            if not __writer:
+                __writer = Thread(target=__write, name='Log writer', daemon=True)
+                __writer.start()
+                if not __exit_registered:
+                    atexit.register(stop)
+                    __exit_registered = True
+    try:
+        __records.put_nowait((time(), message, interchange))
+    except Full:
+        dropped += 1
+
+
+def stop():
+    """ Write all records queued and stop the writer. """
+    global __writer
+    with __writer_lock:
+        if __writer:
+            __records.put(None)
+            __writer.join()
+            __writer = None
 
 
 def error(message):
-    out('<!ERROR!> %s' % message)
+    if __level <= ERROR:
+        out('<!ERROR!> %s' % message)
 
 
 def warning(message):
-    out('<-WARN-> %s' % message)
+    if __level <= WARNING:
+        out('<-WARN-> %s' % message)
 
 
 def info(message):
-    out('<+INFO+> %s' % message)
+    if __level <= INFO:
+        out('<+INFO+> %s' % message)
 
 
 def debug(message):
-    out('<~DEBUG~> %s' % message)
+    if __level <= DEBUG:
+        out('<~DEBUG~> %s' % message)
 
 
 def bus_income(topic, message):
-    out('>>[%s]>> %s' % (topic, message), True)
+    if __bus_sampling and not next(__bus_counter) % __bus_sampling:
+        out('>>[%s]>> %s' % (topic, message), True)
 
 
 def bus_outcome(topic, message):
-    out('<<[%s]<< %s' % (topic, message), True)
+    if __bus_sampling and not next(__bus_counter) % __bus_sampling:
+        out('<<[%s]<< %s' % (topic, message), True)
+
+
+def __write():
+    file = None
+    file_path = ''
+    file_started = 0
+    dropped_reported = 0
+    while True:
+        # Take all records queued (the writer waits for the first one)
+        records = [__records.get()]
+        try:
+            while records[-1] is not None and len(records) < BATCH_SIZE:
+                records.append(__records.get_nowait())
+        except Empty:
+            pass
+        if dropped != dropped_reported:
+            records.insert(0, (time(), '<-WARN-> %d log records have been dropped.' % (dropped - dropped_reported),
+                               False))
+            dropped_reported = dropped
+        # Write
+        for record in records:
+            if record is None:
+                if file:
+                    file.close()
+                return
+            moment, message, interchange = record
+            line = '%s %s' % (ctime(moment), message)
+            if __logfile and not interchange:
+                try:
+                    if not file:
+                        file_path = __logfile
+                        file_started = __get_started(file_path)
+                        file = open(file_path, 'a')
+                    if file.tell() > ROTATE_SIZE or (file.tell() and time() - file_started > ROTATE_PERIOD):
+                        file.close()
+                        file = None
+                        __rotate(file_path)
+                        file = open(file_path, 'a')
+                        file_started = time()
+                    file.write(line + '\n')
+                except OSError as err:
+                    print('%s (log file failure: %s)' % (line, err))
+            else:
+                print(line)
+        if file:
+            file.flush()
+
+
+def __get_started(logfile: str) -> float:
+    """ Get the time of the first record in the log file (now if the file is empty or absent). """
+    try:
+        with open(logfile) as file:
+            return mktime(strptime(file.readline()[:24]))
+    except (OSError, ValueError, OverflowError):
+        return time()
+
+
+def __rotate(logfile: str):
+    for i in range(ROTATE_COUNT - 1, 0, -1):
+        if os.path.exists('%s.%d' % (logfile, i)):
+            os.replace('%s.%d' % (logfile, i), '%s.%d' % (logfile, i + 1))
+    os.replace(logfile, logfile + '.1')
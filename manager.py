@@ -6,16 +6,40 @@ import bus
 import inventory as inv
 from inventory import DatabaseError as StorageError
 import scheduler as sch
-from actors import create_actor
+import runtime
+import snapshot
+import thingspeak
+from onboarding import Onboarding
+from actors import create_actor, load_plugins
 import json
+import signal
+from time import time
+
+TIMETABLE_OCCURRENCES = 10  # occurrences of an interval job listed by get-timetable by default
+TIMETABLE_OCCURRENCES_MAX = 100     # occurrences of an interval job listed by get-timetable at most
+ONBOARDING_CONCURRENCY = 4  # Node handshakes run at a time
+ONBOARDING_RATE = 5         # Node handshakes started per second (on average)
+ONBOARDING_BURST = 5        # Node handshakes started at once
+ONBOARDING_RETRIES = 3      # failed handshakes retried before waiting for the next hello of the Node
+ONBOARDING_RETRY_DELAY = 5  # seconds before the first retry of a failed handshake (doubled for next ones)
+
+__onboarding = None         # handshakes with Nodes said hello
 
 
 # Initiation ---
 
-def start(server_address: str='localhost'):
+def start(server_address: str='localhost', mode: str=runtime.MODE_THREADS):
+    """
+    Start the Manager.
+    :param server_address: address of the server hosting the Bus and Storage
+    :param mode: runtime.MODE_THREADS or runtime.MODE_ASYNCIO (Bus, timers and Scheduler are run by an event loop)
+    """
     # Init log
     log.init('/var/log/khome.log' if server_address == 'localhost' else '')
     log.info('Starting with a Server on %s.' % server_address)
+    # Actor types defined by plugins
+    for plugin in load_plugins():
+        log.info('Plugin %s has been loaded.' % plugin)
     # Configuration
     try:
         # Storage
@@ -23,24 +47,69 @@ def start(server_address: str='localhost'):
         # Load - Actors to Inventory
         actor_configs = inv.load_actors_start()
         for aid in actor_configs:
-            inv.register_actor(create_actor(actor_configs[aid], aid))
+            try:
+                inv.register_actor(create_actor(actor_configs[aid], aid))
+            except inv.ActorError as err:
+                log.warning('%s.' % err)
         inv.load_actors_stop()
         log.info('Configuration has been loaded from Storage.')
     except StorageError as err:
         log.error('Cannot init Storage %s.' % err)
+    # Warm restart - Nodes are restored from the snapshot until their Agents say hello
+    snapshot_path = snapshot.FILE if server_address == 'localhost' else snapshot.LOCAL_FILE
+    snapshot.load(snapshot_path)
+    snapshot.start(snapshot_path)
+    # Stop gracefully when the Daemon is stopped
+    signal.signal(signal.SIGTERM, on_terminate)
     # Bus and Scheduler
     try:
-        # Bus
-        bus.init(server_address, on_connect_to_bus, on_message_from_bus)
-        log.info('Connected to Bus.')
-        # Scheduler
-        sch.init_timer()
-        log.info('Scheduler has been started.')
-        # Start
-        bus.listen()
+        if mode == runtime.MODE_ASYNCIO:
+            runtime.run(run_async, server_address)
+        else:
+            connect(server_address)
+            bus.listen()
     except (ConnectionRefusedError, TimeoutError) as err:
         log.error('Cannot connect to Bus (%s).' % err)
         log.info('KHome manager stops with failure.')
+    finally:
+        # Store data buffered (not interrupted by repeated signals)
+        signal.signal(signal.SIGTERM, signal.SIG_IGN)
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        bus.flush_all()
+        snapshot.stop(snapshot_path)
+        thingspeak.shutdown()
+        inv.storage_shutdown()
+
+
+def connect(server_address: str):
+    global __onboarding
+    # Onboarding - hellos of all Agents (after Bus reconnect) are not answered at once
+    if not __onboarding:
+        __onboarding = Onboarding(onboard_node, ONBOARDING_CONCURRENCY, ONBOARDING_RATE, ONBOARDING_BURST,
+                                  ONBOARDING_RETRIES, ONBOARDING_RETRY_DELAY)
+    # Bus
+    bus.route('/nodes/+', handle_node_data, on_node_response, ordered=True)
+    bus.route('/data/+/+', handle_module_data, on_module_response, ordered=True)
+    bus.route('/manager', on_north_message)
+    bus.init(server_address, on_connect_to_bus)
+    log.info('Connected to Bus.')
+    # Scheduler
+    sch.init_timer()
+    log.info('Scheduler has been started.')
+
+
+def on_terminate(signum, frame):
+    # the Daemon repeats the signal until the process exits - it should not break storing data buffered
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    log.info('KHome manager is stopping (signal %d).' % signum)
+    raise SystemExit(0)
+
+
+async def run_async(server_address: str):
+    """ Serve the Bus and Scheduler by the event loop (asyncio mode). """
+    connect(server_address)
+    log.info('Event loop is running.')
+    await bus.listen_async()
 
 
 # Bus ISR ---
@@ -53,42 +122,31 @@ def on_connect_to_bus():
         True)
 
 
-def on_message_from_bus(topic, message):
-    coordinates = topic.split('/')
+def on_node_response(nid: str, message) -> bool:
+    """
+    Pre-process a message of a Node right in the Bus thread (before dispatching).
+    Agent responses are matched with Node sessions here as session requesters could occupy dispatch workers.
+    :return: True if the message is consumed
+    """
+    return handle_agent_response(nid, '/nodes/%s' % nid, message)
+
+
+def on_module_response(nid: str, mal: str, message) -> bool:
+    """ Pre-process a message of a Module (see on_node_response), it is processed by handle_module_data anyway. """
+    handle_agent_response(nid, '/data/%s/%s' % (nid, mal), message)
+    return False
+
+
+def on_north_message(message):
+    """
+    :param message: request for the Manager parsed by the bus
+    """
     try:
-        # Message -> Object or Str
-        try:
-            message_object = json.loads(message)    # json-structured data
-        except (TypeError, ValueError):
-            message_object = message                # plain data
-        # South - data from an Agent
-        if coordinates[1] in ('nodes', 'data'):
-            # Request response
-            if handle_agent_response(coordinates, message_object):
-                pass
-            # Node data
-            elif coordinates[1] == 'nodes':     # /nodes/<nid>
-                handle_node_data(
-                    coordinates[2],
-                    message_object)
-            # Module data
-            elif coordinates[1] == 'data':      # /data/<nid>/<mal>
-                handle_module_data(
-                    coordinates[2],
-                    coordinates[3],
-                    message_object)
-        # North - request for the Manager
-        elif coordinates[1] == 'manager':                           # /manager
-            # Process request for the Manager
-            handle_north(message)
+        handle_north(message)
     except KeyError as error_object:
         bus.send(
             "/error",
             "Key %s is absent in the request: %s" % (str(error_object), message))
-    except IndexError:
-        bus.send(
-            "/error",
-            "Wrong request format in topic [%s]: %s" % (topic, message))
 
 
 # Handling South ---
@@ -102,25 +160,42 @@ def handle_node_data(nid: str, data):
     """
     # Node said hello
     if isinstance(data, dict) and 'id' in data:
-        # Add/update Node
-        node = inv.register_node(data)
-        # Ask the Node for Module cfg
-        if node:
-            gpio_data = node.send_config({"get": "gpio"})
-            if is_agent_response_success(gpio_data):
-                try:
-                    node = inv.nodes[nid]
-                    for module_cfg in gpio_data['gpio']:
-                        inv.register_module(node, module_cfg)
-                    log.info('Node %s has been initiated with Modules: %s' %
-                             (str(node), str(["%s (%s)" % (
-                                 node.modules[m].config['a'],
-                                 node.modules[m].config['name']) for m in node.modules])))
-                except KeyError:
-                    pass
-        # Ask all modules data
-        if nid in inv.nodes:
-            inv.nodes[nid].send_config({"get": "data"})
+        if __onboarding:
+            __onboarding.admit(nid, data)
+        else:
+            onboard_node(nid, data)
+
+
+def onboard_node(nid: str, data: dict) -> bool:
+    """
+    Handshake with Node said hello: add/update Node and ask it for Modules and their data.
+    :param nid: id of a Node said hello
+    :param data: Hello message
+    :return: False if the Agent has not answered in time (the handshake should be retried)
+    """
+    # Add/update Node (the Node restored from the snapshot or not answered before is reconciled)
+    node = inv.register_node(data) or inv.refresh_node(data)
+    # Ask the Node for Module cfg
+    if node:
+        gpio_data = node.send_config({"get": "gpio"})
+        if is_agent_response_missing(gpio_data):
+            return False
+        if not is_agent_response_success(gpio_data):
+            return True
+        try:
+            node = inv.nodes[nid]
+            inv.reconcile_modules(node, gpio_data['gpio'])
+            log.info('Node %s has been initiated with Modules: %s' %
+                     (str(node), str(["%s (%s)" % (
+                         node.modules[m].config['a'],
+                         node.modules[m].config['name']) for m in node.modules])))
+        except KeyError:
+            pass
+    # Ask all modules data
+    try:
+        return not is_agent_response_missing(inv.nodes[nid].send_config({"get": "data"}))
+    except KeyError:
+        return True
 
 
 def handle_module_data(nid: str, mal: str, data):
@@ -139,17 +214,16 @@ def handle_module_data(nid: str, mal: str, data):
         pass
 
 
-def handle_agent_response(coordinates: list, response) -> bool:
+def handle_agent_response(nid: str, topic: str, response) -> bool:
+    """
+    :return: True if the response is matched with a request of the Node session
+    """
     try:
-        node = inv.nodes[coordinates[2]]    # type: inv.Node
+        node = inv.nodes[nid]    # type: inv.Node
         node.alive()
-        if node.session.active:
-            node.session.stop(response)
-            if coordinates[1] != 'data':    # data from Module should be processed by handle_module_data
-                return True                 # further processing is not necessary
+        return node.session.active and node.session.resolve(topic, response)
     except (AttributeError, KeyError):
-        pass
-    return False
+        return False
 
 
 def is_agent_response_success(response) -> bool:
@@ -161,15 +235,23 @@ def is_agent_response_success(response) -> bool:
     return not(isinstance(response, dict) and inv.KHOME_AGENT_INTERFACE['negative'] in response)
 
 
+def is_agent_response_missing(response) -> bool:
+    """
+    :param response: response come from Agent
+    :return: True if Agent has not answered (timeout or too many requests in flight)
+    """
+    return response == inv.TIMEOUT_RESPONSE or response == inv.BUSY_RESPONSE
+
+
 # Handling North ---
 
 def handle_north(message):
     """
     Process command from data bus and send result back
-    :param message: kind of {"session":<session-id>,"request":<command>,"params":{<params-set>}}
+    :param message: kind of {"session":<session-id>,"request":<command>,"params":{<params-set>}} (dict or str)
     """
     answer = ""
-    request = json.loads(message)
+    request = json.loads(message) if isinstance(message, str) else message
     # Mandatory params
     sid = request['session']
     # Process request
@@ -177,13 +259,18 @@ def handle_north(message):
         request_type = request['request']
         # Report - Agents structure
         if request_type == 'get-structure':
-            answer = request_manage_structure(request)
+            answer = request_manage_structure(request, True)
         # Report - Data
         elif request_type == 'get-data':
-            answer = request_manage_data(request)
+            answer = request_manage_data(request, True)
         # Report - Timetable
         elif request_type == 'get-timetable':
-            answer = request_manage_timetable()
+            answer = request_manage_timetable(request)
+        # Report - Manager statistics
+        elif request_type == 'get-stats':
+            answer = {"bus": bus.get_stats()}
+            if __onboarding:
+                answer['onboarding'] = __onboarding.get_stats()
         # South - Agent ping
         elif request_type == 'ping':
             answer = request_manage_ping(request)
@@ -200,7 +287,7 @@ def handle_north(message):
         #         answer = '{"ack": "%d"}' % inv.actors[params['actor']].handle_north(request_type, params)
         #     except KeyError:
         #         pass
-    except (TypeError, inv.ModuleError, inv.NodeError) as err:
+    except (TypeError, inv.ModuleError, inv.NodeError, inv.ActorError) as err:
         answer = {inv.KHOME_AGENT_INTERFACE['negative']: str(err)}
     except KeyError as err:
         answer = {inv.KHOME_AGENT_INTERFACE['negative']: "Key %s is absent in the request" % err}
@@ -218,50 +305,98 @@ def answer_north(sid: str, message):
             message if message else '{"unknown":}')
 
 
-def request_manage_structure(request: dict) -> dict:
+def request_manage_structure(request: dict, encoded: bool=False):
+    """
+    Export the structure or its changes made after the revision in params (if it is given).
+    :param encoded: return the whole structure as JSON
+    :return: dict or JSON str (the structure export is shared - it should not be changed)
+    """
     try:
-        if str(inv.revision) == request['params']['revision']:
+        since = int(request['params']['revision'])
+    except (KeyError, TypeError, ValueError):
+        since = None
+    if since is not None:
+        if since == inv.revision:
             # Nothing has been changed - export revision number only
             return {'revision': str(inv.revision)}
-    except KeyError:
-        pass
-    # Export the whole structure otherwise
-    return {
-        'revision': inv.revision,
-        'module-types': inv.KHOME_AGENT_INTERFACE['module_types'],
-        'nodes': [inv.nodes[nid].get_export() for nid in inv.nodes],
-        'actors': [inv.actors[aid].get_export() for aid in inv.actors]}
+        # Export changes only if they are known
+        delta = inv.get_structure_delta(since)
+        if delta:
+            return delta
+    # Export the whole structure otherwise (it is built once per revision)
+    _, export, export_json = inv.get_structure()
+    return export_json if encoded else export
 
 
-def request_manage_timetable() -> dict:
-    """ Get all EventJobs registered in the Scheduler timetable. """
+def request_manage_timetable(request: dict) -> dict:
+    """
+    Get all EventJobs registered in the Scheduler timetable
+    and upcoming occurrences of IntervalEventJobs ('limit' per a job, TIMETABLE_OCCURRENCES by default,
+    TIMETABLE_OCCURRENCES_MAX at most).
+    """
+    try:
+        limit = int(request['params']['limit'])
+    except (KeyError, TypeError):
+        limit = TIMETABLE_OCCURRENCES
+    except ValueError:
+        return {inv.KHOME_AGENT_INTERFACE['negative']: "Wrong limit of get-timetable"}
+    limit = min(max(limit, 1), TIMETABLE_OCCURRENCES_MAX)
     timetable = []
-    for time_key in sorted(sch.timetable):
-        for job in sch.timetable[time_key]:
-            if isinstance(job, sch.EventJob):
-                timetable.append({"time": str(job.start_time), "signal": job.value, "handler": job.handler})
-    return {"timetable": timetable}
-
-
-def request_manage_data(request: dict) -> dict:
-    # Gather Boxes data
-    def get_boxes_by_key(__key):
-        return {box_name: inv.boxes[__key][box_name].value for box_name in inv.boxes[__key]}
-
+    for job_time, job in sch.get_timetable():
+        if isinstance(job, sch.EventJob):
+            timetable.append({"time": str(job.start_time), "next": str(job_time),
+                              "signal": job.value, "handler": job.handler})
+        elif isinstance(job, sch.IntervalEventJob):
+            for occurrence in [job_time] + job.get_occurrences(job_time, limit - 1):
+                timetable.append({"time": str(occurrence), "next": str(occurrence),
+                                  "signal": job.value, "handler": job.handler})
+    return {"timetable": sorted(timetable, key=lambda item: item['next'])}
+
+
+def request_manage_data(request: dict, encoded: bool=False):
+    """
+    Export Box values: all of them with Nodes alive data or ones found by params:
+    {"keys": [<box key>], "node": <nid>, "type": <actor type>, "since": <time>, "offset": <n>, "limit": <n>}
+    (all params are optional, a list of Box keys is accepted as well).
+    :param encoded: return all Box values as JSON
+    :return: dict or JSON str
+    """
     # Gather Nodes alive data
     def get_alive_by_nid(__nid):
         node = inv.nodes[__nid]     # type: inv.Node
         return {"alive": node.is_alive, "LTA": node.last_time_alive}
 
     # Result
-    if 'params' in request:
-        # Gather boxes with the box keys from the request
-        boxes = {key: get_boxes_by_key(key) for key in request['params']}
-        return {"boxes": boxes}
+    params = request.get('params')
+    if params:
+        # Gather boxes found by the params
+        if isinstance(params, list):
+            params = {'keys': params}
+        try:
+            keys = params.get('keys')
+            if keys is not None and not (isinstance(keys, list) and all(isinstance(key, str) for key in keys)):
+                raise ValueError('keys')
+            since = float(params.get('since', 0))
+            offset = int(params.get('offset', 0))
+            limit = int(params['limit']) if 'limit' in params else None
+            if offset < 0 or (limit is not None and limit < 0):
+                raise ValueError('offset/limit')
+        except (AttributeError, TypeError, ValueError) as err:
+            return {inv.KHOME_AGENT_INTERFACE['negative']: "Wrong params of get-data (%s)" % err}
+        moment = time()
+        found = inv.find_boxes(keys, str(params.get('node', '')), str(params.get('type', '')), since)
+        if limit is None:
+            limit = len(found)
+        boxes = {}
+        for box in found[offset:offset + limit]:
+            boxes.setdefault(box.key, {})[box.name] = box.value
+        return {"boxes": boxes, "total": len(found), "offset": offset, "time": moment}
     else:
-        # Gather all registered boxes + Nodes alive data
-        boxes = {key: get_boxes_by_key(key) for key in inv.boxes}
-        return {"boxes": boxes, "nodes-alive": {nid: get_alive_by_nid(nid) for nid in inv.nodes}}
+        # Gather all registered boxes (snapshot) + Nodes alive data
+        alive = {nid: get_alive_by_nid(nid) for nid in list(inv.nodes)}
+        if encoded:
+            return '{"boxes": %s, "nodes-alive": %s}' % (inv.get_box_values_json(), json.dumps(alive))
+        return {"boxes": inv.get_box_values(), "nodes-alive": alive}
 
 
 def request_manage_ping(request: dict) -> dict:
@@ -269,7 +404,7 @@ def request_manage_ping(request: dict) -> dict:
     nid = request['params']['node']
     # Send signal to Agent
     try:
-        return inv.nodes[nid].send_config({"ping": ""}, request)
+        return inv.nodes[nid].send_config({"ping": ""})
     except KeyError:
         raise inv.NodeError(nid)
 
@@ -286,7 +421,7 @@ def request_manage_signal(request: dict) -> dict:
     val = params_in['value']
     # Send signal to Agent
     try:
-        response = inv.nodes[nid].modules[mal].send_signal(val, request)
+        response = inv.nodes[nid].modules[mal].send_signal(val)
         return {"ack": response} if is_agent_response_success(response) else response
     except KeyError:
         raise inv.ModuleError(nid, mal)
@@ -326,7 +461,7 @@ def request_manage_modules(request: dict) -> dict:
         if gpio_to_add:
             gpio_result = node.get_cfg_modules() + gpio_to_add
             # upload
-            response = node.send_config(inv.Node.get_gpio(gpio_result), request)
+            response = node.send_config(inv.Node.get_gpio(gpio_result))
             # sync up
             if is_agent_response_success(response):
                 for module_cfg in gpio_to_add:
@@ -339,7 +474,7 @@ def request_manage_modules(request: dict) -> dict:
         # process
         if gpio_to_delete:
             # upload
-            response = node.send_config(inv.Node.get_gpio(gpio_result), request)
+            response = node.send_config(inv.Node.get_gpio(gpio_result))
             # sync up
             if is_agent_response_success(response):
                 for module_cfg in gpio_to_delete:
@@ -361,6 +496,7 @@ def request_manage_modules(request: dict) -> dict:
                     if module.config['name'] != updated_cfg['name']:
                         module.config['name'] = updated_cfg['name']
                         inv.store_module(module)
+                        module.apply_changes()
                 # Update Module cfg
                 is_gpio_updated = False
                 existing_cfg = module.get_cfg()
@@ -380,7 +516,7 @@ def request_manage_modules(request: dict) -> dict:
             else:
                 gpio_result.append(node.modules[mal].get_cfg())
         # upload
-        response = node.send_config(inv.Node.get_gpio(gpio_result), request)
+        response = node.send_config(inv.Node.get_gpio(gpio_result))
         # sync up
         if is_agent_response_success(response):
             for mal in gpio_to_update:
@@ -408,6 +544,7 @@ def request_manage_actors(request: dict) -> dict:
     if request['request'] == 'add-actor':
         actor = create_actor(params_in)
         if actor:
+            inv.check_chain(actor)     # reject the Actor before it is stored
             actor.store_db()
             inv.register_actor(actor)
             updated |= True
@@ -427,9 +564,14 @@ def request_manage_actors(request: dict) -> dict:
         # Update
         try:
             actor = inv.actors[aid]     # type: inv.Actor
+            # Move to another source (the chain of Actors is checked)
+            source = {item: data_from_request[item] for item in ('src', 'src_mdl') if item in data_from_request}
+            if source:
+                inv.set_actor_source(actor, source)
+                updated |= True
             # Merge current and requested parameters
             for item in data_from_request:
-                if item != 'id':
+                if item not in ('id', 'src', 'src_mdl'):
                     actor.config['data'][item] = data_from_request[item]
                     updated |= True
             # Store sync
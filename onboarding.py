@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+""" Admission of Node handshakes - Agents are configured at a limited rate and concurrency. """
+
+from time import monotonic, sleep
+from collections import OrderedDict
+from threading import Thread, Lock, Condition
+import runtime
+import log
+
+
+class TokenBucket(object):
+    """ Rate limiter: [rate] tokens per second are added to the bucket holding [burst] tokens at most. """
+    def __init__(self, rate: float, burst: int):
+        if rate <= 0 or burst < 1:
+            raise ValueError('Token bucket needs a positive rate and burst (%s, %s)' % (rate, burst))
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = monotonic()
+        self.__lock = Lock()
+
+    def acquire(self):
+        """ Take a token waiting for it if the bucket is empty. """
+        with self.__lock:
+            now = monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate) - 1
+            self.updated = now
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0   # the token is reserved
+        if wait:
+            sleep(wait)
+
+
+class Onboarding(object):
+    """
+    Handshakes with Nodes said hello are done by [concurrency] workers, started at [rate] per second at most.
+    A Node has one handshake at a time, the latest hello is used if it says hello again while waiting.
+    Failed handshakes (the Agent has not answered) are retried after a delay doubled each time.
+    """
+    def __init__(self, handshake, concurrency: int, rate: float, burst: int, retries: int, retry_delay: float,
+                 name: str='Onboarding'):
+        """
+        :param handshake: function(nid, hello) -> bool, False if the handshake should be retried
+        """
+        self.handshake = handshake
+        self.name = name
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.bucket = TokenBucket(rate, burst)
+        self.pending = OrderedDict()    # Nodes waiting for a handshake: nid: (hello, attempt)
+        self.active = set()             # Nodes having a handshake
+        self.retrying = 0               # failed handshakes waiting for their retries
+        self.done = 0                   # handshakes succeeded
+        self.retried = 0                # handshakes failed and retried
+        self.failed = 0                 # handshakes failed finally
+        self.__condition = Condition()
+        self.__stopping = False
+        self.__workers = [Thread(target=self.__run, name='%s-%d' % (name, i), daemon=True)
+                          for i in range(max(concurrency, 1))]
+        for worker in self.__workers:
+            worker.start()
+
+    def admit(self, nid: str, hello, attempt: int=0):
+        """
+        Put the Node to the queue of handshakes (the caller is not blocked).
+        :param nid: Node ID
+        :param hello: Hello message of the Node
+        :param attempt: number of failed handshakes before
+        """
+        with self.__condition:
+            if attempt:
+                self.retrying -= 1
+            if attempt == 0 or nid not in self.pending:     # retry does not override a new hello
+                self.pending[nid] = (hello, attempt)
+            self.__condition.notify_all()
+
+    def get_stats(self) -> dict:
+        with self.__condition:
+            return {
+                "pending": len(self.pending),
+                "active": len(self.active),
+                "done": self.done,
+                "retried": self.retried,
+                "failed": self.failed}
+
+    def join(self, timeout: float=None) -> bool:
+        """
+        Wait till all handshakes (with their retries) are finished.
+        :return: False if the timeout is over
+        """
+        with self.__condition:
+            return self.__condition.wait_for(lambda: not (self.pending or self.active or self.retrying), timeout)
+
+    def stop(self, timeout: float=None):
+        """ Stop the workers after handshakes in progress (Nodes waiting are not onboarded). """
+        with self.__condition:
+            self.__stopping = True
+            self.__condition.notify_all()
+        for worker in self.__workers:
+            worker.join(timeout)
+
+    def __next_node(self):
+        """
+        Wait for a Node which handshake could be started.
+        :return: (nid, hello, attempt) or None if the onboarding is stopped
+        """
+        while not self.__stopping:
+            for nid in self.pending:
+                if nid not in self.active:
+                    hello, attempt = self.pending.pop(nid)
+                    self.active.add(nid)
+                    return nid, hello, attempt
+            self.__condition.wait()
+        return None
+
+    def __run(self):
+        while True:
+            with self.__condition:
+                taken = self.__next_node()
+            if not taken:
+                return
+            nid, hello, attempt = taken
+            self.bucket.acquire()
+            try:
+                is_done = self.handshake(nid, hello)
+            except Exception as err:
+                log.error('%s of Node %s has failed (%s).' % (self.name, nid, err))
+                is_done = False
+            with self.__condition:
+                self.active.discard(nid)
+                if is_done:
+                    self.done += 1
+                elif attempt < self.retries:
+                    self.retried += 1
+                    self.retrying += 1
+                    runtime.call_later(self.retry_delay * 2 ** attempt, self.admit, nid, hello, attempt + 1)
+                else:
+                    self.failed += 1
+                    log.warning('%s of Node %s has failed %d times, waiting for its next hello.' %
+                                (self.name, nid, attempt + 1))
+                self.__condition.notify_all()
@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Runtime of the Manager - timers and blocking calls.
+Modes available:
+- threads: the bus client is run by its own thread, timers are fired by the timer wheel thread (default);
+- asyncio: the bus client, Node session timeouts and Scheduler ticks are run by one event loop.
+All timers are kept in one timer wheel in both modes: it is ticked by its thread or by the event loop.
+Message handlers are blocking code (Storage, HTTP, Node sessions) so they are run by workers in both modes.
+"""
+
+import asyncio
+from math import ceil
+from time import monotonic
+from threading import Thread, Condition, Lock
+from concurrent.futures import ThreadPoolExecutor
+import log
+
+MODE_THREADS = 'threads'
+MODE_ASYNCIO = 'asyncio'
+BLOCKING_WORKERS = 4        # workers for blocking calls made from timers and the event loop
+WHEEL_RESOLUTION = 0.1      # seconds per timer wheel tick
+WHEEL_SLOTS = 512           # timer wheel size (ticks per revolution)
+
+mode = MODE_THREADS     # current mode
+loop = None             # event loop (asyncio mode)
+__executor = None       # workers for blocking calls
+__executor_lock = Lock()
+
+
+class WheelTimer(object):
+    """ Timer kept in TimerWheel. It could be cancelled and rescheduled any time from any thread. """
+    def __init__(self, wheel, callback, args):
+        self.wheel = wheel          # type: TimerWheel
+        self.callback = callback
+        self.args = args
+        self.slot = None            # wheel slot keeping the timer (None - the timer is not scheduled)
+        self.rounds = 0             # wheel revolutions left before the timer is due
+
+    def cancel(self):
+        self.wheel.cancel(self)
+
+    def reschedule(self, delay: float):
+        """ Move the deadline of the timer (schedule it again if it has been fired or cancelled). """
+        self.wheel.schedule(self, delay)
+
+    def is_scheduled(self) -> bool:
+        return self.slot is not None
+
+
+class TimerWheel(object):
+    """
+    Hashed timer wheel - all timers are served by one thread (or by the event loop the wheel is attached to).
+    A timer is kept in the slot of its deadline tick so it is scheduled, rescheduled and cancelled in O(1).
+    """
+    def __init__(self, resolution: float=WHEEL_RESOLUTION, slots: int=WHEEL_SLOTS):
+        self.resolution = resolution
+        self.slots = [{} for _ in range(slots)]    # slot: timer -> None (ordered set)
+        self.position = 0                           # slot of the latest tick
+        self.count = 0                              # timers scheduled
+        self.__tick_time = monotonic()              # time of the latest tick
+        self.__condition = Condition()
+        self.__thread = None
+        self.__loop = None                          # event loop ticking the wheel instead of the thread
+        self.__loop_ticking = False                 # the next tick is scheduled on the event loop
+
+    def call_later(self, delay: float, callback, *args) -> WheelTimer:
+        """ Call a function after a delay by the wheel thread (or by the event loop). """
+        timer = WheelTimer(self, callback, args)
+        self.schedule(timer, delay)
+        return timer
+
+    def schedule(self, timer: WheelTimer, delay: float):
+        with self.__condition:
+            if timer.slot is not None:
+                del timer.slot[timer]
+                self.count -= 1
+            elif not self.count:
+                # the wheel has been idle - start counting ticks from now
+                self.__tick_time = monotonic()
+            ticks = max(1, ceil((monotonic() + delay - self.__tick_time) / self.resolution))
+            timer.rounds = (ticks - 1) // len(self.slots)
+            timer.slot = self.slots[(self.position + ticks) % len(self.slots)]
+            timer.slot[timer] = None
+            self.count += 1
+            self.__start()
+            self.__condition.notify()
+
+    def cancel(self, timer: WheelTimer):
+        with self.__condition:
+            if timer.slot is not None:
+                del timer.slot[timer]
+                timer.slot = None
+                self.count -= 1
+
+    def attach(self, event_loop: asyncio.AbstractEventLoop):
+        """ Tick the wheel by the event loop (the wheel thread stops). """
+        with self.__condition:
+            self.__loop = event_loop
+            self.__loop_ticking = False
+            self.__start()
+            self.__condition.notify()
+
+    def detach(self):
+        """ Tick the wheel by its thread again. """
+        with self.__condition:
+            self.__loop = None
+            self.__start()
+
+    def __start(self):
+        # Start ticking if timers are scheduled (called under the lock)
+        if not self.count:
+            return
+        if self.__loop:
+            if not self.__loop_ticking:
+                self.__loop_ticking = True
+                self.__loop.call_soon_threadsafe(self.__tick_loop, self.__loop)
+        elif not self.__thread:
+            self.__thread = Thread(target=self.__run, name='Timer wheel', daemon=True)
+            self.__thread.start()
+
+    def __tick(self) -> list:
+        """ Pass all ticks elapsed and collect due timers (called under the lock). """
+        due = []
+        while self.__tick_time + self.resolution <= monotonic():
+            self.__tick_time += self.resolution
+            self.position = (self.position + 1) % len(self.slots)
+            slot = self.slots[self.position]
+            for timer in list(slot):
+                if timer.rounds:
+                    timer.rounds -= 1
+                else:
+                    del slot[timer]
+                    timer.slot = None
+                    due.append(timer)
+        self.count -= len(due)
+        return due
+
+    @staticmethod
+    def __fire(due: list):
+        # Fire (out of the lock - callbacks could reschedule timers)
+        for timer in due:
+            try:
+                timer.callback(*timer.args)
+            except Exception as err:
+                log.error('Timer callback %s failed with %r.' % (getattr(timer.callback, '__name__', ''), err))
+
+    def __tick_loop(self, event_loop: asyncio.AbstractEventLoop):
+        with self.__condition:
+            if event_loop is not self.__loop:
+                return      # the wheel has been detached
+            due = self.__tick() if self.count else []
+            if self.count:
+                event_loop.call_later(max(0, self.__tick_time + self.resolution - monotonic()),
+                                      self.__tick_loop, event_loop)
+            else:
+                self.__loop_ticking = False
+        self.__fire(due)
+
+    def __run(self):
+        while True:
+            with self.__condition:
+                if self.__loop:
+                    self.__thread = None
+                    return      # the event loop ticks the wheel
+                if not self.count:
+                    self.__condition.wait()
+                    continue
+                delay = self.__tick_time + self.resolution - monotonic()
+                if delay > 0:
+                    self.__condition.wait(delay)
+                    continue
+                due = self.__tick()
+            self.__fire(due)
+
+
+wheel = TimerWheel()    # timers of the Manager
+
+
+def call_later(delay: float, callback, *args) -> WheelTimer:
+    """
+    Call a function after a delay.
+    The function is called by the event loop (asyncio mode) or by the timer wheel thread (threads mode)
+    so it should not block - see call_blocking().
+    :return: timer which could be cancelled/rescheduled
+    """
+    return wheel.call_later(delay, callback, *args)
+
+
+def call_blocking(function, *args):
+    """ Call a function which could block by a worker (not by the event loop or the timer wheel thread). """
+    global __executor
+    with __executor_lock:
+        if not __executor:
+            __executor = ThreadPoolExecutor(BLOCKING_WORKERS, 'Blocking')
+    __executor.submit(function, *args)
+
+
+def run(coroutine_function, *args):
+    """
+    Run the Manager on the event loop (asyncio mode) till the coroutine is finished.
+    :param coroutine_function: coroutine function starting the Manager
+    :param args: arguments for the coroutine function
+    """
+    async def main():
+        global mode, loop
+        mode = MODE_ASYNCIO
+        loop = asyncio.get_running_loop()
+        wheel.attach(loop)
+        try:
+            await coroutine_function(*args)
+        finally:
+            wheel.detach()
+            mode = MODE_THREADS
+            loop = None
+
+    asyncio.run(main())
@@ -1,10 +1,12 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-import time
 import datetime
-import re
-from threading import Timer
+import heapq
+from calendar import monthrange
+from itertools import count
+from threading import Lock
+import runtime
 import inventory as inv
 
 
@@ -163,6 +165,73 @@ class JobTime(object):
             self._nvl(self.minute, 0),
             self._nvl(self.hour, 0))
 
+    def get_next(self, after: datetime.datetime):
+        """
+        Get the nearest time matching this template which is later than 'after'.
+        :return: datetime or None if there is no such time
+        """
+        second = self._nvl(self.second, 0)
+        moment = after.replace(microsecond=0) + datetime.timedelta(seconds=1)
+        # Move to the start of the next matching unit (from years to seconds) till all units match
+        for _ in range(NEXT_TIME_ATTEMPTS):
+            if self.year > -1 and moment.year != self.year:
+                if moment.year > self.year:
+                    return None
+                moment = datetime.datetime(self.year, 1, 1)
+            elif self.month > -1 and moment.month != self.month:
+                if moment.month < self.month:
+                    moment = datetime.datetime(moment.year, self.month, 1)
+                else:
+                    moment = datetime.datetime(moment.year + 1, 1, 1)
+            elif self.day > -1 and moment.day != self.day:
+                if moment.day < self.day <= monthrange(moment.year, moment.month)[1]:
+                    moment = datetime.datetime(moment.year, moment.month, self.day)
+                else:
+                    moment = datetime.datetime(moment.year + moment.month // 12, moment.month % 12 + 1, 1)
+            elif self.hour > -1 and moment.hour != self.hour:
+                if moment.hour < self.hour:
+                    moment = moment.replace(hour=self.hour, minute=0, second=0)
+                else:
+                    moment = moment.replace(hour=0, minute=0, second=0) + datetime.timedelta(days=1)
+            elif self.minute > -1 and moment.minute != self.minute:
+                if moment.minute < self.minute:
+                    moment = moment.replace(minute=self.minute, second=0)
+                else:
+                    moment = moment.replace(minute=0, second=0) + datetime.timedelta(hours=1)
+            elif moment.second != second:
+                if moment.second < second:
+                    moment = moment.replace(second=second)
+                else:
+                    moment = moment.replace(second=0) + datetime.timedelta(minutes=1)
+            else:
+                return moment
+        return None
+
+    def get_previous(self, moment: datetime.datetime):
+        """
+        Get the latest time matching this template which is not later than 'moment'.
+        :return: datetime or None if there is no such time
+        """
+        # step back for a cycle of the template and go forward through matching times
+        if self.year > -1:
+            since = datetime.datetime(self.year, 1, 1)
+        elif self.month > -1:
+            since = moment - datetime.timedelta(days=366)
+        elif self.day > -1:
+            since = moment - datetime.timedelta(days=62)    # e.g. the 31st could be two months ago
+        elif self.hour > -1:
+            since = moment - datetime.timedelta(days=1)
+        elif self.minute > -1:
+            since = moment - datetime.timedelta(hours=1)
+        else:
+            since = moment - datetime.timedelta(minutes=1)
+        previous = None
+        current = self.get_next(since - datetime.timedelta(seconds=1))
+        while current and current <= moment:
+            previous = current
+            current = self.get_next(current)
+        return previous
+
 
 class Job(object):
     """ Job unit which could be scheduled at a start_time to be handled by Actors tied to handler. """
@@ -175,6 +244,19 @@ class Job(object):
         if self.start_time:
             add_job(self)
 
+    def get_next_time(self, after: datetime.datetime):
+        """
+        Get the nearest time to process the Job which is later than 'after'.
+        :return: datetime or None if the Job should not be processed anymore
+        """
+        if isinstance(self.start_time, datetime.datetime):
+            return self.start_time if self.start_time > after else None    # once
+        return self.start_time.get_next(after)
+
+    def reschedule(self, after: datetime.datetime):
+        """ Schedule the Job again after it has been processed at 'after' time. """
+        add_job(self, after)
+
     def process(self):
         pass
 
@@ -198,147 +280,113 @@ class EventJob(Job):
 
 class IntervalEventJob(Job):
     """
-    Maintain job configurations (EventJob factory)
-    supposing same actions performed with a period within some time interval.
+    Job which is performed with a period within some time interval (recurring with the interval).
     'period' - period of action to be triggered within time interval
     'start' - begin of time interval
     'stop' - end of time interval
+    Only the next occurrence is scheduled, it is calculated when the previous one has been processed.
     """
     def __init__(self, handler: str, cfg: dict):
         super().__init__(handler)
         self.config = cfg
-
-    def schedule(self):
-        """ Schedule (instantiate) a row of jobs related to the Interval. """
-        start_template = JobTime(self.config['start'])
-        stop_template = JobTime(self.config['stop'])
-        period_template = JobTime(self.config['period'])
-        period_delta = period_template.get_timedelta()
-        # shift start time to the next interval if stop time has been passed already
-        start_time = start_template.get_datetime(int(not stop_template > datetime.datetime.now()))
-        # shift stop time to the next period if the stop time is less than start time
-        stop_time = stop_template.get_datetime(int(stop_template < start_time), start_time)
-
-        # Schedule EventJobs for the calculated period
-        while stop_time >= start_time:
-            EventJob(
-                self.handler,
-                self.config['value'],
-                start_time
-            ).schedule()
-            start_time += period_delta
-
-        # Schedule this interval job to stop_time in order to re-schedule it again
-        self.start_time = stop_time
-        super().schedule()
+        self.value = cfg['value']                   # value which is scheduled by this Job
+        self.start_time = JobTime(cfg['start'])     # begin of time interval
+        self.stop_time = JobTime(cfg['stop'])       # end of time interval
+        self.period = max(JobTime(cfg['period']).get_timedelta(), datetime.timedelta(seconds=1))
+
+    def get_next_time(self, after: datetime.datetime):
+        # the interval 'after' is in (the latest start and the nearest stop after it)
+        start_time = self.start_time.get_previous(after)
+        if start_time:
+            stop_time = self.stop_time.get_next(start_time - datetime.timedelta(seconds=1))
+            if stop_time and after < stop_time:
+                next_time = start_time + self.period * ((after - start_time) // self.period + 1)
+                if next_time <= stop_time:
+                    return next_time
+        # the next interval
+        return self.start_time.get_next(after)
+
+    def get_occurrences(self, after: datetime.datetime, limit: int) -> list:
+        """ Get the nearest times the Job is to be processed at (later than 'after'). """
+        occurrences = []
+        next_time = self.get_next_time(after)
+        while next_time and len(occurrences) < limit:
+            occurrences.append(next_time)
+            next_time = self.get_next_time(next_time)
+        return occurrences
 
     def process(self):
-        """ Reschedule jobs from corresponding interval again. """
-        # ask Scheduler to clean job list from obsolete event jobs related to this interval job (Scheduler.process)
-        global clean_timetable
-        clean_timetable = True
-        # ask Scheduler to re-schedule this interval job
-        global jobs_to_reschedule
-        jobs_to_reschedule.append(self)
+        inv.handle_value(self.handler, self.value)
 
 
 # Scheduler - Manage job objects
 
-timetable = {}             # scheduled jobs list. Structure: [time_minutes] -> list of time_seconds
-jobs_to_reschedule = []    # list of jobs to be rescheduled
-clean_timetable = False    # necessity of timetable cleaning from obsolete jobs
+NEXT_TIME_ATTEMPTS = 400    # limit of steps looking for the next time of a template
+MAX_SLEEP = 300             # seconds - the wall clock is re-checked at least so often (it could be adjusted)
+
+timetable = []              # scheduled jobs - heap of [time to process, sequence number, job]
+__sequence = count()        # sequence number keeps the order of jobs scheduled for the same time
+__lock = Lock()
+__timer = None              # timer waking the Scheduler up at the time of the nearest job
 
 
 def init_timer():
     """ Init the timer which is used by Scheduler. """
-    on_timer()
-
-
-def on_timer():
-    now = time.localtime()
-    Timer(60 - now.tm_sec, on_timer).start()
-    process(
-        '%d:%02d:%02d:%02d:%02d' % (now.tm_year, now.tm_mon, now.tm_mday, now.tm_hour, now.tm_min),
-        now.tm_sec)
-
-
-def add_job(job: Job) -> str:
-    # calc time-key of the job
-    time_cell = ''
-    dt_object = job.start_time
-    if dt_object.minute > -1:
-        time_cell = '%02d' % dt_object.minute + time_cell
-    if dt_object.hour > -1:
-        time_cell = '%02d' % dt_object.hour + ':' + time_cell
-    if dt_object.day > -1:
-        time_cell = '%02d' % dt_object.day + ':' + time_cell
-    if dt_object.month > -1:
-        time_cell = '%02d' % dt_object.month + ':' + time_cell
-    if dt_object.year > -1:
-        time_cell = str(dt_object.year) + ':' + time_cell
-    # register job in the timetable with its time-key
-    global timetable
-    try:
-        timetable[time_cell].append(job)
-    except KeyError:
-        timetable[time_cell] = [job]
-    return time_cell
+    global __timer
+    __timer = runtime.call_later(0, process)
 
 
-def clean():
-    """ Clean Timetable from all obsolete and empty time cells. """
-    now = datetime.datetime.now()
-    to_wipe = []
-    global timetable
-    # collect obsolete jobs to be wiped out
-    for time_cell in timetable:
-        value = JobTime(time_cell)
-        if (not value.is_template and not value > now) or (not timetable[time_cell]):
-            to_wipe.append(time_cell)
-    # wipe obsolete jobs found out
-    for time_cell in to_wipe:
-        del timetable[time_cell]
-    # Reset
-    global clean_timetable
-    clean_timetable = False
+def add_job(job: Job, after: datetime.datetime=None):
+    """
+    Put the Job to the timetable at the nearest time it should be processed.
+    :param job: Job to be scheduled
+    :param after: time the nearest time is looked for after (now by default)
+    :return: time the Job is scheduled at (None if it is obsolete)
+    """
+    next_time = job.get_next_time(after or datetime.datetime.now())
+    if next_time:
+        with __lock:
+            heapq.heappush(timetable, [next_time, next(__sequence), job])
+            is_nearest = timetable[0][2] is job
+        if is_nearest:
+            wake_up()
+    return next_time
+
+
+def wake_up():
+    """ Reschedule the Scheduler timer to the time of the nearest job. """
+    if __timer:
+        with __lock:
+            delay = (timetable[0][0] - datetime.datetime.now()).total_seconds() if timetable else MAX_SLEEP
+        __timer.reschedule(min(max(delay, 0), MAX_SLEEP))
 
 
 def clear(handler: str = '0'):
     """ Clear Timetable from Jobs related to some Handler or all. """
     global timetable
-    if handler:
-        for time_cell in timetable:
-            new_time_cell = [job for job in timetable[time_cell] if job.handler != handler]
-            timetable[time_cell] = new_time_cell
-        clean()    # wipe all empty time cells
-    else:
-        timetable = {}
+    with __lock:
+        if handler:
+            timetable = [item for item in timetable if item[2].handler != handler]
+            heapq.heapify(timetable)
+        else:
+            timetable = []
 
 
-def process(time_now: str, correction_sec: int = 0):
-    """
-    :param time_now: time to the nearest minute
-    :param correction_sec: difference in seconds if the processing is started not in :00
-    :return: nothing
-    """
-    global timetable
-    # Check all jobs scheduled - find jobs with time_cell related to the time_now
-    for time_cell in timetable:
-        if re.search(time_cell + '$', time_now):
-            # It is time to do all jobs related to this time key
-            for job in timetable[time_cell]:
-                if job.start_time.second:
-                    # wait for item.seconds
-                    Timer(job.start_time.second - correction_sec, job.process).start()
-                else:
-                    # process value right now
-                    job.process()
-    # Clean jobs list (clean_timetable)
-    global clean_timetable
-    if clean_timetable:
-        clean()
-    # Reschedule jobs (jobs_to_reschedule)
-    global jobs_to_reschedule
-    for job in jobs_to_reschedule:
-        job.schedule()
-    jobs_to_reschedule = []
+def get_timetable() -> list:
+    """ Get scheduled jobs sorted by time - list of (time to process, job). """
+    with __lock:
+        return [(item[0], item[2]) for item in sorted(timetable)]
+
+
+def process():
+    """ Process all jobs which time has come, schedule their next time and sleep till the nearest job. """
+    now = datetime.datetime.now()
+    due = []
+    with __lock:
+        while timetable and timetable[0][0] <= now:
+            due.append(heapq.heappop(timetable))
+    for job_time, _, job in due:
+        # process in a worker (jobs could block) and reschedule the Job after this time
+        runtime.call_blocking(job.process)
+        job.reschedule(job_time)
+    wake_up()
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Snapshot of the inventory (Nodes, Modules, Box values, revision) in a local file for warm restarts.
+The Manager restores Nodes from the snapshot at start and serves North requests at once,
+Nodes restored are reconciled with their Agents when they say hello.
+"""
+
+import os
+import json
+from time import time
+import inventory as inv
+import runtime
+import log
+
+FILE = '/var/lib/khome/snapshot.json'
+LOCAL_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'khome-snapshot.json')  # Server is not local
+PERIOD = 60             # seconds between snapshots (a snapshot is written only if something has changed)
+REVISION_GAP = 1000     # revisions skipped on restore - changes made after the latest snapshot could be seen by North
+VERSION = 1             # snapshot format
+
+__saved = None          # (revision, Box values version) of the latest snapshot
+__timer = None
+
+
+def save(path: str=FILE) -> bool:
+    """
+    Write the snapshot if the inventory has been changed since the latest one.
+    The file is replaced atomically - a crash does not leave a broken snapshot.
+    :return: True if the snapshot is written
+    """
+    global __saved
+    state = inv.revision, inv.box_values_version
+    if state == __saved:
+        return False
+    snapshot = {
+        'version': VERSION,
+        'revision': state[0],
+        'time': time(),
+        'nodes': [{'config': node.config, 'modules': [module.config for module in list(node.modules.values())]}
+                  for node in list(inv.nodes.values())],
+        'boxes': inv.get_box_values()}
+    # Configs are encoded while handlers could change them - the snapshot is tried again next time
+    try:
+        encoded = json.dumps(snapshot, separators=(',', ':'))
+    except (RuntimeError, TypeError, ValueError) as err:
+        log.warning('Cannot encode the snapshot (%s).' % err)
+        return False
+    temp_path = path + '.tmp'
+    try:
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with open(temp_path, 'w') as file:
+            file.write(encoded)
+        os.replace(temp_path, path)
+    except OSError as err:
+        log.warning('Cannot write the snapshot to %s (%s).' % (path, err))
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        return False
+    __saved = state
+    return True
+
+
+def load(path: str=FILE) -> bool:
+    """
+    Restore Nodes with their Modules and Box values from the snapshot (Actors should be loaded before).
+    Nodes restored are not alive until their Agents talk.
+    :return: True if the snapshot is loaded
+    """
+    try:
+        with open(path) as file:
+            snapshot = json.load(file)
+        if snapshot.get('version') != VERSION:
+            raise ValueError('unknown version %s' % snapshot.get('version'))
+        # the structure is checked before anything is restored
+        node_snapshots = [(dict(node['config']), [dict(module_cfg) for module_cfg in node['modules']])
+                          for node in snapshot['nodes']]
+        box_snapshots = [(key, name, value)
+                         for key, values in snapshot['boxes'].items() for name, value in values.items()]
+        revision = int(snapshot['revision'])
+    except FileNotFoundError:
+        return False
+    except (OSError, ValueError, KeyError, TypeError, AttributeError) as err:
+        log.warning('Cannot load the snapshot from %s (%s).' % (path, err))
+        return False
+    for node_cfg, module_cfgs in node_snapshots:
+        node = inv.register_node(node_cfg)
+        if node:
+            for module_cfg in module_cfgs:
+                inv.register_module(node, module_cfg)
+    for key, name, value in box_snapshots:
+        try:
+            inv.boxes[key][name].value = value
+        except KeyError:
+            pass    # the Box has gone
+    inv.restart_revision(revision + REVISION_GAP)
+    log.info('%d Nodes have been restored from the snapshot of %s.' % (len(node_snapshots), path))
+    return True
+
+
+def start(path: str=FILE, period: float=PERIOD):
+    """ Write snapshots periodically. """
+    global __timer
+
+    def on_timer():
+        runtime.call_blocking(save, path)
+        __timer.reschedule(period)
+
+    __timer = runtime.call_later(period, on_timer)
+
+
+def stop(path: str=FILE):
+    """ Stop writing snapshots periodically and write the latest one. """
+    if __timer:
+        __timer.cancel()
+    save(path)
@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Uploading data to ThingSpeak in background.
+Samples of a channel are coalesced and uploaded by bulk updates over keep-alive connections.
+"""
+
+import json
+from time import time, strftime, gmtime
+from threading import Thread, Condition, Lock, BoundedSemaphore
+from urllib.parse import urlencode
+import http.client as http_client
+import log
+
+HOST = 'api.thingspeak.com:80'
+CONNECTIONS = 2         # keep-alive connections (and upload workers) per host
+UPLOAD_PERIOD = 15      # seconds between uploads to a channel (ThingSpeak rate limit)
+RETRY_MAX = 300         # seconds - the longest delay between retries
+BUFFER_SIZE = 960       # samples waiting for uploading per channel (ThingSpeak bulk update maximum)
+TIMEOUT = 10            # seconds to wait for a response
+
+__uploaders = {}        # Uploader by host
+__uploaders_lock = Lock()
+
+
+class ConnectionPool(object):
+    """ Keep-alive HTTP connections to one host. """
+    def __init__(self, host: str, size: int=CONNECTIONS, timeout: float=TIMEOUT):
+        self.host = host
+        self.timeout = timeout
+        self.idle = []
+        self.lock = Lock()
+        self.slots = BoundedSemaphore(size)
+
+    def request(self, method: str, url: str, body: str, headers: dict) -> tuple:
+        """
+        Send a request using an idle connection (a new one is opened if there is no idle connection).
+        The request is repeated by a new connection once if the idle one has been closed by the server.
+        :return: (status, response body)
+        """
+        with self.slots:
+            with self.lock:
+                connection = self.idle.pop() if self.idle else None
+            is_reused = bool(connection)
+            if not connection:
+                connection = http_client.HTTPConnection(self.host, timeout=self.timeout)
+            try:
+                try:
+                    connection.request(method, url, body, headers)
+                    response = connection.getresponse()
+                except (OSError, http_client.HTTPException):
+                    if not is_reused:
+                        raise
+                    # there is no response - the server has closed the idle connection
+                    connection.close()
+                    connection = http_client.HTTPConnection(self.host, timeout=self.timeout)
+                    connection.request(method, url, body, headers)
+                    response = connection.getresponse()
+                result = response.status, response.read().decode('utf-8', 'replace')
+            except (OSError, http_client.HTTPException):
+                connection.close()      # broken connection is not reused
+                raise
+            with self.lock:
+                self.idle.append(connection)
+            return result
+
+    def close(self):
+        with self.lock:
+            for connection in self.idle:
+                connection.close()
+            self.idle = []
+
+
+class Channel(object):
+    """ Samples waiting for uploading to a ThingSpeak channel. """
+    def __init__(self, key: str, channel: str):
+        self.key = key              # write API key
+        self.channel = channel      # channel ID (bulk update is not available without it)
+        self.samples = []           # [time, {field: value}]
+        self.due = 0                # time the samples could be uploaded at (a period after the latest upload)
+        self.failures = 0           # failed uploads in a row
+        self.busy = False           # samples are being uploaded
+
+
+class Uploader(object):
+    """
+    Uploads samples in background by workers (not blocking the caller).
+    Samples of a channel gathered for an upload period are uploaded by one request:
+    - bulk update if the channel ID is known,
+    - update with the latest value of every field otherwise.
+    Failed uploads are retried with exponential backoff.
+    """
+    def __init__(self, host: str=HOST, connections: int=CONNECTIONS, period: float=UPLOAD_PERIOD):
+        self.host = host
+        self.period = period
+        self.pool = ConnectionPool(host, connections)
+        self.channels = {}          # Channel by (write API key, channel ID)
+        self.uploaded = 0           # requests succeeded
+        self.failed = 0             # requests failed
+        self.dropped = 0            # samples dropped
+        self.__condition = Condition()
+        self.__stopping = False     # samples waiting are uploaded at once, failed uploads are not retried
+        self.__workers = [Thread(target=self.__run, name='Uploader %s' % host, daemon=True)
+                          for _ in range(connections)]
+        for worker in self.__workers:
+            worker.start()
+
+    def put(self, key: str, fields: dict, channel: str=''):
+        """
+        Put a sample to the upload queue.
+        :param key: write API key of the channel
+        :param fields: {field: value}
+        :param channel: channel ID
+        """
+        with self.__condition:
+            try:
+                target = self.channels[(key, channel)]
+            except KeyError:
+                target = self.channels[(key, channel)] = Channel(key, channel)
+            target.samples.append([time(), fields])
+            if len(target.samples) > BUFFER_SIZE:
+                del target.samples[0]
+                self.dropped += 1
+            self.__condition.notify()
+
+    def stop(self, timeout: float=TIMEOUT):
+        """ Upload all samples waiting (not waiting for the end of upload periods) and stop the workers. """
+        with self.__condition:
+            self.__stopping = True
+            self.__condition.notify_all()
+        for worker in self.__workers:
+            worker.join(timeout)
+        self.pool.close()
+
+    def __next_channel(self):
+        """
+        Wait for a channel which samples should be uploaded and take its samples.
+        :return: (channel, samples) or None if the uploader is stopped and there is nothing to upload
+        """
+        while True:
+            now = time()
+            waiting = [ch for ch in self.channels.values() if ch.samples and not ch.busy]
+            due = [ch for ch in waiting if ch.due <= now or self.__stopping]
+            if due:
+                target = min(due, key=lambda ch: ch.due)
+                target.busy = True
+                samples, target.samples = target.samples, []
+                return target, samples
+            if self.__stopping:
+                return None
+            self.__condition.wait(min([ch.due for ch in waiting]) - now if waiting else None)
+
+    def __run(self):
+        while True:
+            with self.__condition:
+                taken = self.__next_channel()
+            if not taken:
+                return
+            target, samples = taken
+            is_uploaded = self.upload(target, samples)
+            with self.__condition:
+                target.busy = False
+                if is_uploaded:
+                    target.failures = 0
+                    target.due = time() + self.period
+                elif self.__stopping:
+                    self.dropped += len(samples)
+                    log.warning('%d samples have not been uploaded to %s.' % (len(samples), self.host))
+                else:
+                    # return samples to the queue and retry later
+                    target.failures += 1
+                    target.samples[:0] = samples
+                    overflow = len(target.samples) - BUFFER_SIZE
+                    if overflow > 0:
+                        del target.samples[:overflow]
+                        self.dropped += overflow
+                    target.due = time() + min(self.period * 2 ** target.failures, RETRY_MAX)
+                self.__condition.notify()
+
+    def upload(self, target: Channel, samples: list) -> bool:
+        """
+        Upload samples of the channel.
+        :return: False if uploading should be retried
+        """
+        if target.channel:
+            url = '/channels/%s/bulk_update.json' % target.channel
+            body = json.dumps({
+                "write_api_key": target.key,
+                "updates": [dict(fields, created_at=strftime('%Y-%m-%dT%H:%M:%SZ', gmtime(moment)))
+                            for moment, fields in samples]})
+            headers = {"Content-type": "application/json"}
+        else:
+            url = '/update'
+            data = {'key': target.key}
+            for _, fields in samples:
+                data.update(fields)     # the latest value wins
+            body = urlencode(data)
+            headers = {"Content-type": "application/x-www-form-urlencoded", "Accept": "text/plain"}
+        try:
+            status, response = self.pool.request("POST", url, body, headers)
+        except (OSError, http_client.HTTPException) as err:
+            status, response = 0, str(err)
+        if status in (200, 202) and response.strip() != '0':   # '0' - update was rejected (rate limit)
+            with self.__condition:
+                self.uploaded += 1
+            return True
+        log.warning('Cannot upload %d samples to %s, response: %d "%s"' % (len(samples), self.host, status, response))
+        is_wrong = 400 <= status < 500 and status != 429
+        with self.__condition:
+            self.failed += 1
+            if is_wrong:
+                self.dropped += len(samples)
+        return is_wrong     # request is wrong - retrying does not help
+
+
+def get_uploader(host: str=HOST) -> Uploader:
+    """ Get the uploader shared by all who upload data to the host. """
+    with __uploaders_lock:
+        if host not in __uploaders:
+            __uploaders[host] = Uploader(host)
+        return __uploaders[host]
+
+
+def shutdown():
+    """ Upload all samples waiting and stop the uploaders. """
+    with __uploaders_lock:
+        uploaders = list(__uploaders.values())
+        __uploaders.clear()
+    for uploader in uploaders:
+        uploader.stop()